@@ -0,0 +1,58 @@
+from modules.book2vec import Model
+from modules.ann import IVFIndex
+import logging
+import random
+from time import perf_counter
+import numpy as np
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+benchmark_logger = logging.getLogger("benchmark")
+
+
+def benchmark_ann(n_queries=200, topn=10, nprobe_list=(1, 4, 8, 16, 32, 64)):
+    """
+    Compare the ANN index with the exact wv.most_similar in recall@topn and latency.
+    """
+    model = Model()
+    model.load_model(inference=True)
+    wv = model.wv
+
+    ann = model.ann
+    if ann is None:
+        benchmark_logger.info("Building the ANN index...")
+        ann = IVFIndex.build(wv.vectors)
+    benchmark_logger.info(f"{len(ann)} vectors, {ann.nlist} clusters")
+
+    rows = random.sample(range(len(wv)), min(n_queries, len(wv)))
+
+    start = perf_counter()
+    expected = [
+        {key for key, _ in wv.most_similar(wv.index_to_key[row], topn=topn)}
+        for row in rows
+    ]
+    exact_ms = (perf_counter() - start) / len(rows) * 1000
+    benchmark_logger.info(f"exact: {exact_ms:.2f} ms/query")
+
+    for nprobe in nprobe_list:
+        recalls = []
+        latencies = []
+        for row, truth in zip(rows, expected):
+            start = perf_counter()
+            indices, _ = ann.search(wv.vectors[row], topn, nprobe=nprobe, exclude=[row])
+            latencies.append((perf_counter() - start) * 1000)
+            found = {wv.index_to_key[i] for i in indices}
+            recalls.append(len(found & truth) / topn)
+        benchmark_logger.info(
+            f"nprobe={nprobe}: recall@{topn}={np.mean(recalls):.3f}, "
+            f"mean={np.mean(latencies):.2f} ms, p99={np.percentile(latencies, 99):.2f} ms"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_ann()
@@ -0,0 +1,79 @@
+from modules.book2vec import Model
+from gensim.models import Word2Vec
+import logging
+import random
+from time import perf_counter
+import numpy as np
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+benchmark_logger = logging.getLogger("benchmark")
+
+# corpus preprocessing options compared with the default parameters
+VARIANTS = {
+    # word2vec is not deterministic: the overlap of a second baseline is the noise floor
+    "baseline (retrained)": {},
+    "min_count=2": {"min_count": 2},
+    "min_count=5": {"min_count": 5},
+    "max_shelf=500 random": {"max_shelf": 500, "shelf_chunking": "random"},
+    "max_shelf=500 window": {"max_shelf": 500, "shelf_chunking": "window"},
+    "sample=1e-4": {"sample": 1e-4},
+    "sample=1e-5": {"sample": 1e-5},
+}
+
+
+def _train(model, options):
+    params = dict(model.default_params, **options)
+    start = perf_counter()
+    w2v = Word2Vec(**model._get_model_params(params))
+    return w2v.wv, perf_counter() - start
+
+
+def _neighbors(wv, keys, topn):
+    return [{key for key, _ in wv.most_similar(key, topn=topn)} for key in keys]
+
+
+def benchmark_corpus(n_queries=500, topn=10):
+    """
+    Train the model with each corpus preprocessing option and report the
+    vocabulary size, the training time and the overlap@topn of the similar
+    books with the ones of the default parameters.
+    """
+    model = Model(use_snapshot=True)
+    model._generate_sentences()
+
+    baseline, elapsed = _train(model, {})
+    benchmark_logger.info(f"baseline: {len(baseline)} books, {elapsed:.1f} s")
+
+    # books kept by every variant, so that each query can be answered
+    min_count = max(
+        options.get("min_count", model.default_params["min_count"])
+        for options in VARIANTS.values()
+    )
+    candidates = [
+        key
+        for key in baseline.index_to_key
+        if baseline.get_vecattr(key, "count") >= min_count
+    ]
+    keys = random.sample(candidates, min(n_queries, len(candidates)))
+    expected = _neighbors(baseline, keys, topn)
+
+    for name, options in VARIANTS.items():
+        wv, elapsed = _train(model, options)
+        overlaps = [
+            len(found & truth) / topn
+            for found, truth in zip(_neighbors(wv, keys, topn), expected)
+        ]
+        benchmark_logger.info(
+            f"{name}: {len(wv)} books ({len(wv) / len(baseline):.1%}), "
+            f"{elapsed:.1f} s, overlap@{topn}={np.mean(overlaps):.3f}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_corpus()
@@ -0,0 +1,63 @@
+from modules.parser import BACKENDS
+import logging
+import os
+from time import perf_counter
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+benchmark_logger = logging.getLogger("benchmark")
+
+# synthetic pages following the Booklog markup (see fixtures/booklog/README.md)
+FIXTURE_DIR = "fixtures/booklog"
+
+# fixture -> extraction function of the backends
+EXTRACTIONS = {
+    "profiletags.html": "profile_tags",
+    "profiletag.html": "profile_tag_users",
+    "ranking.html": "ranking_book_urls",
+    "review.html": "reviewer_ids",
+}
+
+# fixture -> values every backend must extract
+EXPECTED = {
+    "profiletags.html": [f"タグ{i}" for i in range(200)],
+    "profiletag.html": [f"user{i:03d}" for i in range(25)],
+    "ranking.html": [f"/item/1/{4000000000 + i}" for i in range(50)],
+    "review.html": [f"reviewer{i:03d}" for i in range(20)],
+}
+
+
+def benchmark_parser(repeat=200):
+    """
+    Parse the fixture pages with every installed backend, check that they
+    extract the expected values and report the time per page.
+    """
+    pages = {}
+    for name in EXTRACTIONS:
+        with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as f:
+            pages[name] = f.read()
+
+    for backend_name, backend_class in BACKENDS.items():
+        backend = backend_class()
+        for name, html in pages.items():
+            extract = getattr(backend, EXTRACTIONS[name])
+            expected = EXPECTED[name]
+            if extract(html) != expected:
+                raise Exception(f"{backend_name} extracts wrong values from {name}")
+
+            start = perf_counter()
+            for _ in range(repeat):
+                extract(html)
+            elapsed = (perf_counter() - start) / repeat * 1000
+            benchmark_logger.info(
+                f"{backend_name:12} {name:18} {len(expected):4} values: {elapsed:.3f} ms/page"
+            )
+
+
+if __name__ == "__main__":
+    benchmark_parser()
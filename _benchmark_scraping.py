@@ -0,0 +1,110 @@
+from modules.scraping import Scraping
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+import argparse
+import logging
+import threading
+from time import perf_counter, sleep
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+benchmark_logger = logging.getLogger("benchmark")
+
+BOOKS_PER_PAGE = 20
+REVIEWERS_PER_BOOK = 20
+
+
+def ranking_page(year: int, page: int) -> str:
+    items = "".join(
+        f'<li><div class="desc"><h3><a href="/item/1/{year}{page:02d}{i:02d}">'
+        f"book {i}</a></h3></div></li>"
+        for i in range(BOOKS_PER_PAGE)
+    )
+    return (
+        '<html><body><div class="autopagerize_page_element">'
+        f'<ul class="ranking-list">{items}</ul></div></body></html>'
+    )
+
+
+def review_page(book_id: str) -> str:
+    items = "".join(
+        '<li><div class="summary"><div class="user-info-area"><div>'
+        '<div class="user-name-area"><p>'
+        f'<a href="/users/user{book_id}{i:02d}">user</a></p></div></div></div></div></li>'
+        for i in range(REVIEWERS_PER_BOOK)
+    )
+    return f'<html><body><div id="reviewLine"><ul>{items}</ul></div></body></html>'
+
+
+def serve(latency: float) -> ThreadingHTTPServer:
+    """Local Booklog with fixture HTML. Every response is delayed by latency seconds."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            if parts[:2] == ["ranking", "annual"]:
+                page = int(url.query.split("=")[-1])
+                html = ranking_page(int(parts[2]), page)
+            elif parts[:1] == ["item"]:
+                html = review_page(parts[-1])
+            else:
+                self.send_error(404)
+                return
+            sleep(latency)
+            body = html.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def benchmark_scraping(years: int, concurrency: int, latency: float):
+    """
+    Expand ranking -> books -> reviewers over the fixture server and report
+    the pages fetched per second.
+    """
+    server = serve(latency)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    scraper = Scraping(concurrency=concurrency, delay=0, browsers=0, base_url=base_url)
+
+    start = perf_counter()
+    users = 0
+    for year in range(2015, 2015 - years, -1):
+        book_urls = scraper.get_book_urls_from_ranking(year)
+        for _, user_id_list in scraper.get_users_from_book_urls(book_urls):
+            users += len(user_id_list or [])
+    elapsed = perf_counter() - start
+
+    pages = scraper.fetcher.stats["http"] + scraper.fetcher.stats["browser"]
+    benchmark_logger.info(
+        f"concurrency={concurrency}: {pages} pages, {users} users in {elapsed:.2f} s "
+        f"({pages / elapsed:.1f} pages/s)"
+    )
+    scraper.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+    for c in args.concurrency:
+        benchmark_scraping(args.years, c, args.latency)
@@ -0,0 +1,55 @@
+from modules.suggest import PrefixIndex
+import logging
+import os
+import random
+import sys
+from time import perf_counter
+import numpy as np
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+benchmark_logger = logging.getLogger("benchmark")
+
+
+def load_queries(index, path=None, n_queries=1000):
+    """
+    Queries from a file (one search word per line), e.g. collected from the
+    search form. Without a file, titles of the most read books are used.
+    """
+    if path and os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    books = sorted(index.books.values(), key=lambda book: -book[2])
+    return [title for title, _, _ in books[:n_queries] if title]
+
+
+def benchmark_suggest(path=None, limit=10):
+    """
+    Replay every prefix of each query, as typed character by character.
+    """
+    index = PrefixIndex.load()
+    benchmark_logger.info(f"{len(index)} books, {len(index.keys)} keys")
+
+    queries = load_queries(index, path)
+    prefixes = [query[:n] for query in queries for n in range(1, len(query) + 1)]
+    random.shuffle(prefixes)
+
+    latencies = []
+    for prefix in prefixes:
+        start = perf_counter()
+        index.search(prefix, limit=limit)
+        latencies.append((perf_counter() - start) * 1000)
+
+    benchmark_logger.info(
+        f"{len(prefixes)} prefixes: p50={np.percentile(latencies, 50):.3f} ms, "
+        f"p99={np.percentile(latencies, 99):.3f} ms, max={max(latencies):.3f} ms"
+    )
+
+
+if __name__ == "__main__":
+    benchmark_suggest(sys.argv[1] if len(sys.argv) > 1 else None)
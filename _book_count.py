@@ -0,0 +1,29 @@
+from modules.database import Database
+import logging
+import sys
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+book_count_logger = logging.getLogger("book_count")
+
+
+def book_count_function(full=False):
+    """
+    Update the reader count (books.count) used to rank search results.
+    Run _search_index.py afterwards so that the search index uses the new counts.
+    """
+    db = Database()
+    db.ensure_indexes()
+
+    book_count_logger.info(f"Books without count: {db.count_books_not_having_count()}")
+    updated = db.update_book_counts(full=full)
+    book_count_logger.info(f"Updated the count of {updated} books.")
+
+
+if __name__ == "__main__":
+    book_count_function(full="--full" in sys.argv)
@@ -1,7 +1,6 @@
-from modules.book_data import BookData
 from modules.database import Database
+from modules.enrichment import GoogleBooksEnricher
 import logging
-from time import sleep
 
 
 # 共通のロギング設定
@@ -20,31 +19,21 @@ book_data_handler = logging.FileHandler(
 book_data_logger.addHandler(book_data_handler)
 
 
-def get_book_data(book_id):
-    book_data = BookData(book_id)
-    book_data.get_data()
-    return
-
-
 def book_data_function():
     """
-    Get information of books from Booklog.
+    Get information of books from Google Books.
     """
     book_data_logger.info("start...")
 
     db = Database()
 
-    book_ids = db.get_book_ids_without_authors()
-    books_len = len(list(book_ids))
-    book_data_logger.info(f"total books: {books_len}")
-
-    for i, book_id in enumerate(db.get_book_ids_without_authors()):
-        if i % 100 == 0:
-            sleep(10)
+    book_ids = [book["_id"] for book in db.get_book_ids_without_authors()]
+    book_data_logger.info(f"total books: {len(book_ids)}")
 
-        book_id = book_id["_id"]
-        book_data_logger.info(f"{i+1}/{books_len} : {book_id}")
-        get_book_data(book_id)
+    enricher = GoogleBooksEnricher(db, concurrency=8, rate=5.0)
+    stats = enricher.run(book_ids)
+    book_data_logger.info(f"done: {stats}")
+    book_data_logger.info(f"lookup stats: {db.get_lookup_stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,32 @@
+from modules.database import Database
+import logging
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+dedupe_logger = logging.getLogger("dedupe_user_books")
+
+
+def dedupe_user_books_function():
+    """
+    One-off cleanup of user_books written before the unique (user_id, book_id)
+    index: delete the duplicates, create the indexes and recount books.count.
+    """
+    db = Database()
+
+    removed = db.remove_duplicate_user_books()
+    dedupe_logger.info(f"Removed {removed} duplicate user_books.")
+    db.ensure_indexes()
+
+    # 重複を削除したので、読者数は全件で数え直す
+    if removed:
+        updated = db.update_book_counts(full=True)
+        dedupe_logger.info(f"Recounted {updated} books.")
+
+
+if __name__ == "__main__":
+    dedupe_user_books_function()
@@ -23,7 +23,7 @@ model_handler.setFormatter(
 
 
 def model_function():
-    model = Model()
+    model = Model(use_snapshot=True)
     db = Database()
 
     # データベースから各テーブルの総数を取得
@@ -35,11 +35,13 @@ def model_function():
     )
 
     model_logger.info("Optimizing the model...")
-    # model.optimize(n_trials=100)
+    # model.optimize(n_trials=100, n_jobs=4)
     # model.update_parameters()
 
     model_logger.info("Training the model...")
-    model.train_model(update=False)
+    # 前回の学習以降に追加されたuser_booksだけで更新する（初回は全件で学習）
+    # 近傍テーブルは更新では作り直さず、NEIGHBORS_MAX_AGE (7日) を過ぎたら作り直す
+    model.train_model(update=True, neighbors_k=100)
     model_logger.info("Model training completed.")
 
 
@@ -0,0 +1,45 @@
+from modules.database import Database
+from modules.search_index import SearchIndex
+from modules.suggest import PrefixIndex
+import logging
+
+# 共通のロギング設定
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S",
+)
+
+search_index_logger = logging.getLogger("search_index")
+
+
+def search_index_function():
+    """
+    Build the search and suggestion indexes over all books and save the snapshots
+    loaded by run.py. Run it on a schedule (e.g. after each crawl), so that new
+    books become searchable: the web workers load a new search index snapshot
+    within SearchIndex.RELOAD_INTERVAL, the suggestion index when they restart.
+    """
+    db = Database()
+    db.ensure_indexes()
+    updated = db.backfill_search_keys()
+    search_index_logger.info(f"Stored search keys of {updated} books.")
+    books = list(db.iter_books_for_search_index())
+
+    search_index_logger.info("Building the search index...")
+    index = SearchIndex.build(books)
+    version = index.save()
+    search_index_logger.info(
+        f"Saved {len(index)} books to {SearchIndex.INDEX_DIR}/{version}"
+    )
+
+    search_index_logger.info("Building the suggestion index...")
+    prefix_index = PrefixIndex.build(books)
+    prefix_index.save()
+    search_index_logger.info(
+        f"Saved {len(prefix_index)} books to {PrefixIndex.INDEX_FILE}"
+    )
+
+
+if __name__ == "__main__":
+    search_index_function()
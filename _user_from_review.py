@@ -1,5 +1,8 @@
 from modules.scraping import Scraping
 from modules.database import Database
+from modules.checkpoint import CrawlCheckpoint
+from modules.pipeline import shelf_pipeline
+from itertools import chain
 import logging
 from winsound import Beep
 
@@ -21,72 +24,64 @@ scraper_handler.setFormatter(
 )
 
 
-def insert(scraper, db, user_id):
-    db.insert_user(user_id)
-    books = scraper.load_books(user_id)
-    for book in books:
-        book_id = book["BOOK_ID"]
-        title = book["TITLE"]
-        db.insert_book(book_id, title)
-        db.insert_user_books(user_id, book_id)
+def discover_users(scraper, checkpoint, years):
+    """
+    Yield the ids of the reviewers of popular books who are not in the
+    database yet.
+    """
+    for year in years:
+        scraper_logger.info(f"Processing year: {year}")
+        try:
+            book_urls = checkpoint.get_or_fetch(
+                f"ranking/{year}", lambda: scraper.get_book_urls_from_ranking(year)
+            )
+        except Exception as e:
+            scraper_logger.error(e)
+            raise e
+
+        # 本のレビュー一覧は並行して取得する (取得済みの本は保存した結果を使う)
+        pending = [u for u in book_urls if not checkpoint.is_done(f"book/{u}")]
+        cached = {u: checkpoint.get(f"book/{u}") for u in pending}
+        fetched = scraper.get_users_from_book_urls(
+            u for u in pending if cached[u] is None
+        )
+        reviewers = chain(
+            ((u, users) for u, users in cached.items() if users is not None), fetched
+        )
+        for num, (book_url, user_id_list) in enumerate(reviewers, 1):
+            if user_id_list is None:
+                scraper_logger.error(f"Failed to load reviewers of [{book_url}]")
+                continue
+            if cached[book_url] is None:
+                checkpoint.set(f"book/{book_url}", user_id_list)
+
+            # 本の全ユーザーが保存されたら、その本は完了になる
+            # (取得に失敗したユーザーがいる場合は、次回の実行でやり直す)
+            # 既に保存済み・重複・別の本から取得中のユーザーは返されない
+            new_users = checkpoint.track(f"book/{book_url}", user_id_list)
+            scraper_logger.info(
+                f"Year: {year}, Book: {num}/{len(pending)}, Users: {len(new_users)}/{len(user_id_list)}"
+            )
+            yield from new_users
 
 
 def scraper_function():
     scraper = Scraping()
     db = Database()
 
+    # 途中経過は crawl_review.db に保存され、再実行すると続きから再開する
+    checkpoint = CrawlCheckpoint("crawl_review.db")
+    seen = checkpoint.load_seen_users(db)
+    scraper_logger.info(f"Seen users: {seen}")
+
     # 本の人気ランキングからユーザーIDを取得
     start_year = 2015
     end_year = 2014  # 2009
 
-    _start_year = start_year
-    _start_book_num = 0
-    _start_user_num = 0
-
-    for year in range(start_year, end_year, -1):
-        scraper_logger.info(f"Processing year: {year}")
-        try:
-            book_urls = scraper.get_book_urls_from_ranking(year)
-        except Exception as e:
-            scraper_logger.error(e)
-            raise e
-        for num, book_url in enumerate(book_urls, 1):
-            if year == _start_year and num < _start_book_num:
-                continue
-            try:
-                user_id_list = scraper.get_users_from_book_url(book_url)
-            except Exception as e:
-                scraper_logger.error(e)
-                raise e
-
-            # ユーザーの書籍リストをデータベースに保存
-            for u_num, user_id in enumerate(user_id_list, 1):
-                if (
-                    year == _start_year
-                    and num == _start_book_num
-                    and u_num < _start_user_num
-                ):
-                    continue
-                scraper_logger.info(
-                    f"Year: {year}, Book: {num}/{len(book_urls)}, User: {u_num}/{len(user_id_list)}, UserID: {user_id}"
-                )
-
-                # ユーザーが既にデータベースに存在する場合はスキップ
-                # ただし、スクレイピングを再開してから最初のユーザーの場合はスキップしない
-                if db.is_user_exists(user_id) and not (
-                    year == _start_year
-                    and num == _start_book_num
-                    and u_num == _start_user_num
-                ):
-                    scraper_logger.error(
-                        f"User [{user_id}] already exists in the database"
-                    )
-                    continue
-                try:
-                    insert(scraper, db, user_id)
-                except TimeoutError:
-                    scraper_logger.error("TimeoutError")
-                    raise TimeoutError
+    # ユーザーの発見 -> 本棚の取得 -> まとめて保存 をキューでつないで並行に処理する
+    # Ctrl-C で止めると、キューに残っているユーザーを保存してから終了する
+    pipeline = shelf_pipeline(scraper, db, checkpoint, logger=scraper_logger)
+    pipeline.run(discover_users(scraper, checkpoint, range(start_year, end_year, -1)))
 
 
 def count_users():
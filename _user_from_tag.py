@@ -1,5 +1,7 @@
 from modules.scraping import Scraping
 from modules.database import Database
+from modules.checkpoint import CrawlCheckpoint
+from modules.pipeline import shelf_pipeline
 import logging
 
 
@@ -20,14 +22,25 @@ user_handler.setFormatter(
 )
 
 
-def insert(scraper, db, user_id):
-    db.insert_user(user_id)
-    books = scraper.load_books(user_id)
-    for book in books:
-        book_id = book["BOOK_ID"]
-        title = book["TITLE"]
-        db.insert_book(book_id, title)
-        db.insert_user_books(user_id, book_id)
+def discover_users(scraper, checkpoint, tags):
+    """
+    Yield the ids of the users of profile tags who are not in the database yet.
+    """
+    for tnum, tag in enumerate(tags, 1):
+        if checkpoint.is_done(f"tag/{tag}"):
+            continue
+
+        user_logger.info(f"Processing tag: {tag} : {tnum} / {len(tags)}")
+        users = checkpoint.get_or_fetch(
+            f"tag/{tag}", lambda: scraper.get_users_from_profile_tag(tag, 100)
+        )
+
+        # タグの全ユーザーが保存されたら、そのタグは完了になる
+        # (取得に失敗したユーザーがいる場合は、次回の実行でやり直す)
+        # 重複したユーザーや、別のタグから取得中のユーザーは返されない
+        new_users = checkpoint.track(f"tag/{tag}", users)
+        user_logger.info(f"New users: {len(new_users)} / {len(users)}")
+        yield from new_users
 
 
 def user_function():
@@ -36,40 +49,22 @@ def user_function():
     scraper = Scraping()
     db = Database()
 
+    # 途中経過は crawl_tag.db に保存され、再実行すると続きから再開する
+    checkpoint = CrawlCheckpoint("crawl_tag.db")
+    seen = checkpoint.load_seen_users(db)
+    user_logger.info(f"Seen users: {seen}")
+
     # 本の人気ランキングからユーザーIDを取得
     # https://booklog.jp/profiletags の人気のプロフィールタグを取得
-    tags = scraper.get_popular_profile_tags()
+    tags = checkpoint.get_or_fetch("profiletags", scraper.get_popular_profile_tags)
 
-    cnt = count_users(db)
-
-    exclude_tag_list = []
-    exclude_user_cnt = 0
-
-    for tnum, tag in enumerate(tags, 1):
-        if tag in exclude_tag_list:
-            cnt += 1000
-            continue
+    count_users(db)
 
-        user_logger.info(f"Processing tag: {tag}")
-        users = scraper.get_users_from_profile_tag(tag, 100)
-
-        # ユーザーの書籍リストをデータベースに保存
-        for num, user in enumerate(users, 1):
-            cnt += 1
-            if cnt < exclude_user_cnt:
-                continue
-
-            user_logger.info(
-                f"{tag} : {tnum} / {len(tags)} - {user} : {num} / {len(users)} - {cnt} / {len(tags) * len(users)}"
-            )
-            if db.is_user_exists(user):
-                user_logger.error(f"User [{user}] already exists in the database")
-                continue
-            try:
-                insert(scraper, db, user)
-            except TimeoutError:
-                user_logger.error(f"TimeoutError: {user}")
-                return
+    # ユーザーの発見 -> 本棚の取得 -> まとめて保存 をキューでつないで並行に処理する
+    # Ctrl-C で止めると、キューに残っているユーザーを保存してから終了する
+    pipeline = shelf_pipeline(scraper, db, checkpoint, logger=user_logger)
+    pipeline.run(discover_users(scraper, checkpoint, tags))
+    count_users(db)
 
 
 def count_users(db):
@@ -0,0 +1,151 @@
+import os
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Approximate nearest neighbour index (inverted file) built with NumPy.
+
+    Vectors are clustered with spherical k-means. A query is compared with
+    the cluster centroids first and only the vectors of the nprobe closest
+    clusters are scored, so a search touches a small part of the vocabulary.
+    The index is saved next to the model as .npy files and loaded
+    memory-mapped.
+    """
+
+    SUFFIXES = {
+        "centroids": ".ivf.centroids.npy",
+        "offsets": ".ivf.offsets.npy",
+        "ids": ".ivf.ids.npy",
+        "vectors": ".ivf.vectors.npy",
+    }
+
+    def __init__(self, centroids, offsets, ids, vectors, nprobe: int = 16):
+        """
+        :param centroids: (nlist, D) normalized cluster centroids.
+        :param offsets: (nlist + 1,) start of each cluster in ids and vectors.
+        :param ids: (N,) row indices of the original vectors, grouped by cluster.
+        :param vectors: (N, D) normalized float16 vectors in the order of ids.
+        :param nprobe: Default number of clusters scored per query.
+        """
+        self.centroids = centroids
+        self.offsets = offsets
+        self.ids = ids
+        self.vectors = vectors
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @staticmethod
+    def normalize(vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    @staticmethod
+    def _assign(vectors, centroids, chunk_size=8192) -> np.ndarray:
+        assign = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), chunk_size):
+            sims = vectors[start : start + chunk_size] @ centroids.T
+            assign[start : start + chunk_size] = np.argmax(sims, axis=1)
+        return assign
+
+    @classmethod
+    def _kmeans(cls, vectors, nlist, n_iter, sample_size, seed) -> np.ndarray:
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assign = cls._assign(vectors, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, vectors)
+            # restart empty clusters from random points
+            empty = np.bincount(assign, minlength=nlist) == 0
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+            centroids = cls.normalize(sums)
+        return centroids
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        nlist: int = None,
+        nprobe: int = 16,
+        n_iter: int = 10,
+        sample_size: int = 50000,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """
+        :param vectors: (N, D) matrix of vectors.
+        :param nlist: Number of clusters. Defaults to 4 * sqrt(N).
+        :param n_iter: Number of k-means iterations.
+        :param sample_size: Number of vectors used to train the centroids.
+        """
+        vectors = cls.normalize(vectors)
+        if nlist is None:
+            nlist = int(4 * np.sqrt(len(vectors)))
+        nlist = max(1, min(nlist, len(vectors), sample_size))
+
+        centroids = cls._kmeans(vectors, nlist, n_iter, sample_size, seed)
+        assign = cls._assign(vectors, centroids)
+        ids = np.argsort(assign, kind="stable").astype(np.int32)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assign, minlength=nlist))
+        return cls(
+            centroids, offsets, ids, vectors[ids].astype(np.float16), nprobe=nprobe
+        )
+
+    def search(self, query: np.ndarray, topn: int = 10, nprobe: int = None, exclude=()):
+        """
+        :param query: (D,) query vector.
+        :param nprobe: Number of clusters to score. Defaults to self.nprobe.
+        :param exclude: Row indices that must not be returned (e.g. the query books).
+        :return: (row indices, similarities) sorted by similarity.
+        """
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query = self.normalize(query)
+
+        centroid_sims = self.centroids @ query
+        probe = np.argpartition(-centroid_sims, nprobe - 1)[:nprobe]
+        ranges = [(self.offsets[c], self.offsets[c + 1]) for c in probe]
+        ids = np.concatenate([self.ids[a:b] for a, b in ranges])
+        sims = np.concatenate(
+            [self.vectors[a:b].astype(np.float32) @ query for a, b in ranges]
+        )
+
+        if len(exclude):
+            keep = ~np.isin(ids, np.asarray(exclude))
+            ids, sims = ids[keep], sims[keep]
+
+        topn = min(topn, len(ids))
+        if topn == 0:
+            return ids[:0], sims[:0]
+        top = np.argpartition(-sims, topn - 1)[:topn]
+        top = top[np.argsort(-sims[top])]
+        return ids[top], sims[top]
+
+    @classmethod
+    def exists(cls, prefix: str) -> bool:
+        return all(os.path.exists(prefix + s) for s in cls.SUFFIXES.values())
+
+    def save(self, prefix: str):
+        for name, suffix in self.SUFFIXES.items():
+            tmp_path = prefix + suffix + ".tmp.npy"
+            np.save(tmp_path, getattr(self, name))
+            os.replace(tmp_path, prefix + suffix)
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: str = "r", nprobe: int = 16) -> "IVFIndex":
+        arrays = {
+            name: np.load(prefix + suffix, mmap_mode=mmap_mode)
+            for name, suffix in cls.SUFFIXES.items()
+        }
+        return cls(nprobe=nprobe, **arrays)
@@ -1,18 +1,112 @@
 import optuna
-from gensim.models import Word2Vec
+from gensim.models import Word2Vec, KeyedVectors
+from gensim.models.callbacks import CallbackAny2Vec
 from modules.database import Database
+from modules.corpus import UserBooksCorpus, CorpusSnapshot, ShelfChunks, group_by_user
+from modules.cache import LRUCache
+from modules.id_dictionary import IdDictionary
+from modules.neighbors import NeighborTable
+from modules.ann import IVFIndex
 import pandas as pd
+import json
+import multiprocessing
 import os
+import shutil
+import time
+
+
+def _link_or_copy(src, dst):
+    """Hard link src to dst, or copy it where links are not supported"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class PruningCallback(CallbackAny2Vec):
+    """
+    Reports the training loss to an Optuna trial after every epoch and stops
+    the training when the pruner decides the trial is not promising.
+    """
+
+    def __init__(self, trial):
+        self.trial = trial
+        self.epoch = 0
+
+    def on_epoch_end(self, model):
+        self.trial.report(model.get_latest_training_loss(), self.epoch)
+        self.epoch += 1
+        if self.trial.should_prune():
+            raise optuna.TrialPruned()
+
+
+def _optimize_worker(
+    sentences, default_params, trial_threads, study_name, storage, pruner, n_trials
+):
+    """Runs trials of a shared study in a worker process"""
+    model = Model()
+    model.sentences = sentences
+    model.default_params = default_params
+    model.trial_threads = trial_threads
+    # the pruner is not stored with the study
+    study = optuna.load_study(study_name=study_name, storage=storage, pruner=pruner)
+    study.optimize(model.objective, n_trials=n_trials)
 
 
 class Model:
+    # Every training writes its files into a new version directory in
+    # MODEL_DIR, and then switches the CURRENT_FILE pointer to it, so that
+    # a reader never loads a mix of old and new files. The file names below
+    # are relative to the version directory (or to the working directory
+    # for a model saved before the versions).
+    MODEL_DIR = "book2vec"
+    CURRENT_FILE = "current"
+    # number of version directories kept for processes still using them
+    KEEP_VERSIONS = 3
     MODEL_FILE = "book2vec.model"
+    # inference-only export: normalized vectors, loaded memory-mapped
+    KEYED_VECTORS_FILE = "book2vec.kv"
+    # training watermark (largest user_books _id the model has seen)
+    MODEL_META_FILE = "book2vec.meta.json"
+    # book id <-> integer id. The model, the corpus snapshot, the neighbour
+    # table and the ANN index use the integer ids; strings are only returned
+    # by get_similar_books(_for_books).
+    # The dictionary in the working directory grows with every training; each
+    # version directory gets a copy of it.
+    BOOK_IDS_FILE = "book2vec.ids.txt"
+    # An update keeps the neighbour table of the previous version (books new
+    # to the vocabulary fall back to an exact search) until it is this old.
+    NEIGHBORS_MAX_AGE = 7 * 24 * 60 * 60
+    # corpus preprocessing options of default_params, which optimize does not
+    # tune: the training losses of differently preprocessed corpora can't be compared
+    CORPUS_PARAMS = ("min_count", "sample", "max_shelf", "shelf_chunking")
+    CORPUS_DIR = "corpus"
+    OPTUNA_STORAGE = "sqlite:///book2vec_optuna.db"
     MODEL_TYPE_MAPPING = {"skipgram": 1, "cbow": 0}
     APPROXIMATION_MAPPING = {"hierarchical": 1, "negative": 0}
 
-    def __init__(self):
+    def __init__(self, use_snapshot=False):
+        """
+        :param use_snapshot: Train from a local corpus snapshot (CORPUS_DIR), which is
+                             refreshed from the database once, instead of streaming
+                             the corpus from the database on every pass.
+        """
+        self.use_snapshot = use_snapshot
+        # version directory of the loaded or trained model
+        self.model_dir = self._current_dir()
+        self.book_ids = IdDictionary(self.BOOK_IDS_FILE)
+        # True for a model trained before the integer ids: its keys are book ids
+        self.string_keys = False
         self.model = None
+        self.wv = None
+        self.neighbors = None
+        self.ann = None
         self.sentences = None
+        self.watermark = None
+        # number of gensim worker threads used by each optimization trial
+        self.trial_threads = None
+        # similar books per (book_id, topn, exact). Cleared whenever a new model is set.
+        self.similar_cache = LRUCache(maxsize=4096, ttl=24 * 60 * 60)
         self.default_params = {
             "model_type": "cbow",
             "approximation": "negative",
@@ -20,26 +114,41 @@ class Model:
             "window": 29,
             "epochs": 5,
             "negative_size": 9,
+            # minimum number of readers of a book (shelves have no duplicates)
             "min_count": 1,
+            # downsampling threshold of frequent books (gensim's sample)
+            "sample": 1e-3,
+            # shelves longer than this are split into chunks ("random" or "window")
+            "max_shelf": None,
+            "shelf_chunking": "random",
         }
 
-    def _load_data_from_db(self):
+    def _generate_sentences(self):
         db = Database()
-        users_books = db.get_all_user_books()
-        return pd.DataFrame(users_books, columns=["user_id", "book_id"])
+        db.ensure_indexes()
+        if self.use_snapshot:
+            snapshot = CorpusSnapshot(self.CORPUS_DIR, books=self.book_ids)
+            if snapshot.refresh(db):
+                print(f"Corpus snapshot updated: {snapshot.read_meta()}")
+            self.sentences = snapshot
+            self.watermark = snapshot.read_meta()["last_id"]
+        else:
+            self.watermark = db.get_last_user_books_id()
+            self.sentences = UserBooksCorpus(db, books=self.book_ids)
 
-    def _generate_sentences(self):
-        users_books = self._load_data_from_db()
-        users_books.drop_duplicates(inplace=True)
-        users_books.dropna(subset=["book_id"], inplace=True)
-        data = users_books.groupby("user_id").agg({"book_id": list})
-        self.sentences = data["book_id"].values.tolist()
+    @staticmethod
+    def _chunk_shelves(sentences, params):
+        if not params.get("max_shelf"):
+            return sentences
+        return ShelfChunks(
+            sentences, params["max_shelf"], params.get("shelf_chunking", "random")
+        )
 
     def _get_model_params(self, params):
         sg = self.MODEL_TYPE_MAPPING[params["model_type"]]
         hs = self.APPROXIMATION_MAPPING[params["approximation"]]
         return {
-            "sentences": self.sentences,
+            "sentences": self._chunk_shelves(self.sentences, params),
             "sg": sg,
             "hs": hs,
             "negative": params["negative_size"],
@@ -48,74 +157,471 @@ class Model:
             "epochs": params["epochs"],
             "compute_loss": True,
             "min_count": params["min_count"],
+            "sample": params.get("sample", 1e-3),
+            "workers": params.get("workers") or 3,
         }
 
-    def train_model(self, update=False):
+    def train_model(self, update=False, neighbors_k=None, ann_index=None):
         """
         Train the model using all the books in the database
+
+        :param update: Update the saved model with the user_books added since it was
+                       trained, including books that are new to the vocabulary.
+        :param neighbors_k: If set, also save a top-K neighbour table next to the model.
+                            If None, an existing table is kept with its current K.
+                            An update reuses the table of the previous version
+                            until it is older than NEIGHBORS_MAX_AGE.
+        :param ann_index: If True, also save an approximate nearest neighbour index.
+                          If None, an existing index is rebuilt.
         """
-        if not self.sentences:
-            print("Generating sentences...")
-            self._generate_sentences()
+        if self.book_ids.path != self.BOOK_IDS_FILE:
+            # load_model opened the copy of a version directory
+            self.book_ids = IdDictionary(self.BOOK_IDS_FILE)
+        previous = self._current_dir()
+        meta = self._read_model_meta(previous)
 
         # train or update the model
-        if update and os.path.exists(self.MODEL_FILE):
-            self.model = Word2Vec.load(self.MODEL_FILE)
-            self.model.train(
-                self.sentences,
-                total_examples=len(self.sentences),  # type: ignore
-                epochs=self.model.epochs,
-            )
+        # models without book_ids were trained on string keys
+        updating = bool(
+            update and meta.get("last_user_books_id") and meta.get("book_ids")
+        )
+        if updating:
+            self._check_book_ids(previous)
+            print("Updating the model...")
+            if not self._update_model(previous, meta):
+                print("No new user_books since the last training.")
+                return
         else:
+            if update:
+                print("No training watermark found. Training from scratch.")
+            if self.sentences is None:
+                print("Generating sentences...")
+                self._generate_sentences()
             print("Training the model...")
             self.model = Word2Vec(**self._get_model_params(self.default_params))
             print(f"Loss: {self.model.get_latest_training_loss()}")
+        print(f"Vocabulary: {len(self.model.wv)} books")
 
-        # save the model
-        print("Saving the model...")
-        self.model.save(self.MODEL_FILE)
+        self.wv = self.model.wv
+        self.string_keys = False
+        self.similar_cache.clear()
 
-    def load_model(self):
-        self.model = Word2Vec.load(self.MODEL_FILE)
+        # save the model into a new version directory
+        self.model_dir = self._new_version_dir()
+        print(f"Saving the model to {self.model_dir}...")
+        self.book_ids.save()
+        shutil.copyfile(self.BOOK_IDS_FILE, self._file(self.BOOK_IDS_FILE))
+        self.model.save(self._file(self.MODEL_FILE))
+        self.export_keyed_vectors()
 
-    def get_similar_books(self, book_id, topn: int = 10) -> pd.DataFrame:
+        previous_prefix = os.path.join(previous, self.MODEL_FILE)
+        has_neighbors = NeighborTable.exists(previous_prefix)
+        if neighbors_k is None and has_neighbors:
+            neighbors_k = NeighborTable.load(previous_prefix).k
+        neighbors_built = None
+        if neighbors_k:
+            age = time.time() - meta.get("neighbors_built", 0)
+            if (
+                updating
+                and has_neighbors
+                and NeighborTable.load(previous_prefix).k == neighbors_k
+                and age < self.NEIGHBORS_MAX_AGE
+            ):
+                print(f"Keeping the neighbour table ({age / 3600:.0f} hours old)...")
+                for src, dst in zip(
+                    NeighborTable.paths(previous_prefix),
+                    NeighborTable.paths(self._file(self.MODEL_FILE)),
+                ):
+                    _link_or_copy(src, dst)
+                self.neighbors = NeighborTable.load(self._file(self.MODEL_FILE))
+                neighbors_built = meta["neighbors_built"]
+            else:
+                self.build_neighbor_table(neighbors_k)
+                neighbors_built = time.time()
+
+        if ann_index is None:
+            ann_index = IVFIndex.exists(previous_prefix)
+        if ann_index:
+            self.build_ann_index()
+
+        meta = {"last_user_books_id": self.watermark, "book_ids": self.BOOK_IDS_FILE}
+        if neighbors_built is not None:
+            meta["neighbors_built"] = neighbors_built
+        self._write_model_meta(meta)
+        self._publish()
+
+    def export_keyed_vectors(self):
+        """
+        Save the normalized vectors without the training state (syn1neg, vocab counts).
+        The vectors are stored as a separate .npy file so that they can be memory-mapped.
+        """
         if not self.model:
             raise Exception("Model is not loaded or trained")
 
-        if book_id not in self.model.wv.key_to_index:
+        print("Exporting the keyed vectors...")
+        wv = self.model.wv
+        kv = KeyedVectors(wv.vector_size)
+        kv.add_vectors(wv.index_to_key, wv.get_normed_vectors())
+        kv.save(self._file(self.KEYED_VECTORS_FILE), separately=["vectors"])
+
+    def _update_model(self, directory: str, meta: dict) -> bool:
+        """
+        Continue training the model saved in directory on the shelves of the users
+        who got new user_books after the watermark. New books are added to the
+        vocabulary after the existing ones, whose rows do not change.
+
+        :return: False if there was nothing to update.
+        """
+        db = Database()
+        last_id = meta["last_user_books_id"]
+        watermark = db.get_last_user_books_id()
+        user_ids = {row.get("user_id") for row in db.iter_user_books_after(last_id)}
+        if not user_ids:
+            return False
+
+        # size of the dictionary before the new books are added
+        known_ids = len(self.book_ids)
+        sentences = [
+            self.book_ids.encode(sentence)
+            for _, sentence in group_by_user(db.iter_user_books_of_users(user_ids))
+        ]
+        n_users = len(sentences)
+        sentences = list(self._chunk_shelves(sentences, self.default_params))
+        self.model = Word2Vec.load(os.path.join(directory, self.MODEL_FILE))
+        vocab_size = len(self.model.wv)
+        if vocab_size and max(self.model.wv.index_to_key) >= known_ids:
+            raise Exception(
+                f"{self.BOOK_IDS_FILE} is missing ids of "
+                f"{os.path.join(directory, self.MODEL_FILE)}. "
+                "Train from scratch with update=False."
+            )
+        self.model.build_vocab(sentences, update=True)
+        self.model.train(
+            sentences, total_examples=len(sentences), epochs=self.model.epochs
+        )
+        print(
+            f"Updated with {n_users} users, "
+            f"{len(self.model.wv) - vocab_size} new books."
+        )
+        self.watermark = watermark
+        return True
+
+    def _check_book_ids(self, directory: str):
+        """
+        Check that BOOK_IDS_FILE still holds the integer ids the model saved in
+        directory was trained with (its copy in directory), since an update
+        encodes the new books with it.
+        """
+        path = os.path.join(directory, self.BOOK_IDS_FILE)
+        if directory == "." or not os.path.exists(path):
+            # models saved before the version directories have no copy;
+            # _update_model checks at least that the ids exist
+            return
+        trained = IdDictionary(path)
+        if not self.book_ids.extends(len(trained), trained.digest()):
+            raise Exception(
+                f"{self.BOOK_IDS_FILE} ({len(self.book_ids)} ids) is not the "
+                f"dictionary the model in {directory} was trained with "
+                f"({len(trained)} ids). Copy {path} to {self.BOOK_IDS_FILE}, "
+                "or train from scratch with update=False."
+            )
+
+    def _current_dir(self) -> str:
+        """Version directory of the published model, or "." for the files saved before the versions"""
+        pointer = os.path.join(self.MODEL_DIR, self.CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return "."
+        with open(pointer, "r") as f:
+            return os.path.join(self.MODEL_DIR, f.read().strip())
+
+    def _new_version_dir(self) -> str:
+        name = time.strftime("%Y%m%d-%H%M%S")
+        directory, n = os.path.join(self.MODEL_DIR, name), 0
+        while os.path.exists(directory):
+            n += 1
+            directory = os.path.join(self.MODEL_DIR, f"{name}-{n}")
+        os.makedirs(directory)
+        return directory
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.model_dir, name)
+
+    def _publish(self):
+        """Point CURRENT_FILE to model_dir and delete the oldest versions"""
+        pointer = os.path.join(self.MODEL_DIR, self.CURRENT_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(os.path.basename(self.model_dir))
+        os.replace(pointer + ".tmp", pointer)
+        print(f"Published {self.model_dir}")
+
+        versions = sorted(
+            (
+                os.path.join(self.MODEL_DIR, name)
+                for name in os.listdir(self.MODEL_DIR)
+                if os.path.isdir(os.path.join(self.MODEL_DIR, name))
+            ),
+            key=os.path.getmtime,
+        )
+        for directory in versions[: -self.KEEP_VERSIONS]:
+            if os.path.samefile(directory, self.model_dir):
+                continue
+            # files memory-mapped by a running process cannot be deleted on Windows;
+            # they are deleted by a later training
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def _read_model_meta(self, directory: str) -> dict:
+        path = os.path.join(directory, self.MODEL_META_FILE)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def _write_model_meta(self, meta: dict):
+        with open(self._file(self.MODEL_META_FILE), "w") as f:
+            json.dump(meta, f)
+
+    def build_neighbor_table(self, k=100):
+        """
+        Precompute the top-K similar books of every book and save them next to the model
+        """
+        if self.wv is None:
+            raise Exception("Model is not loaded or trained")
+
+        print(f"Building the top-{k} neighbour table...")
+        self.neighbors = NeighborTable.build(
+            self.wv.vectors, self._file(self.MODEL_FILE), k
+        )
+        self.similar_cache.clear()
+
+    def build_ann_index(self, nlist=None):
+        """
+        Build the approximate nearest neighbour index and save it next to the model
+        """
+        if self.wv is None:
+            raise Exception("Model is not loaded or trained")
+
+        print("Building the ANN index...")
+        IVFIndex.build(self.wv.vectors, nlist=nlist).save(self._file(self.MODEL_FILE))
+        self.ann = IVFIndex.load(self._file(self.MODEL_FILE))
+        self.similar_cache.clear()
+
+    def load_model(self, inference=False):
+        """
+        :param inference: Load only the exported keyed vectors, memory-mapped and
+                          read-only, so that web workers share one copy in the page cache.
+                          The trainable model is not loaded.
+
+        A model trained before the integer ids (string keys) is still served,
+        with book ids looked up directly, until it is retrained. A model with
+        integer keys fails to load if BOOK_IDS_FILE is missing or older than it.
+        """
+        # every file is read from the same version directory
+        self.model_dir = self._current_dir()
+        self.book_ids = IdDictionary(self._file(self.BOOK_IDS_FILE))
+        if inference:
+            self.model = None
+            self.wv = KeyedVectors.load(self._file(self.KEYED_VECTORS_FILE), mmap="r")
+        else:
+            self.model = Word2Vec.load(self._file(self.MODEL_FILE))
+            self.wv = self.model.wv
+
+        keys = self.wv.index_to_key
+        self.string_keys = bool(keys) and isinstance(keys[0], str)
+        if self.string_keys:
+            print(
+                "Warning: the model was trained on string book ids. "
+                "Retrain it with train_model() to use the integer ids."
+            )
+        elif keys and max(keys) >= len(self.book_ids):
+            raise Exception(
+                f"{self._file(self.BOOK_IDS_FILE)} is missing or older than the model "
+                f"({len(self.book_ids)} ids, largest key {max(keys)}). "
+                "Copy it from the training machine together with the model files."
+            )
+
+        prefix = self._file(self.MODEL_FILE)
+        self.neighbors = None
+        if NeighborTable.exists(prefix):
+            neighbors = NeighborTable.load(prefix)
+            # a table kept by an update covers the books that were in the vocabulary
+            if len(neighbors) <= len(self.wv):
+                self.neighbors = neighbors
+        self.ann = None
+        if IVFIndex.exists(prefix):
+            ann = IVFIndex.load(prefix)
+            if len(ann) == len(self.wv):
+                self.ann = ann
+        self.similar_cache.clear()
+
+    def get_similar_books(
+        self, book_id, topn: int = 10, exact: bool = True
+    ) -> pd.DataFrame:
+        """
+        :param exact: If False, use the ANN index (when it is loaded).
+        """
+        if self.wv is None:
+            raise Exception("Model is not loaded or trained")
+
+        cached = self.similar_cache.get((book_id, topn, exact))
+        if cached is not None:
+            return cached.copy()
+
+        wv = self.wv
+        key = self._encode(book_id)
+        if key not in wv.key_to_index:
             raise KeyError(f"Key '{book_id}' not present in vocabulary")
 
-        similar_books = self.model.wv.most_similar(book_id, topn=topn)
+        row = wv.key_to_index[key]
+        if not exact and self.ann is not None:
+            similar_books = self._search_ann(wv.vectors[row], topn, [row])
+        elif (
+            self.neighbors is not None
+            and row < len(self.neighbors)
+            and topn <= self.neighbors.k
+        ):
+            indices, similarities = self.neighbors.lookup(row, topn)
+            similar_books = [
+                (wv.index_to_key[i], float(s)) for i, s in zip(indices, similarities)
+            ]
+        else:
+            similar_books = wv.most_similar(key, topn=topn)
+        df = self._to_dataframe(similar_books)
+        self.similar_cache.set((book_id, topn, exact), df)
+        return df.copy()
+
+    def get_similar_books_for_books(
+        self, book_ids: list, topn: int = 10, exact: bool = False
+    ) -> pd.DataFrame:
+        """
+        Get books similar to a blend (the mean of the normalized vectors) of several books.
+        Books that are not in the vocabulary are ignored.
+        """
+        if self.wv is None:
+            raise Exception("Model is not loaded or trained")
+
+        wv = self.wv
+        keys = [self._encode(book_id) for book_id in book_ids]
+        keys = [key for key in keys if key in wv.key_to_index]
+        if not keys:
+            raise KeyError("None of the books are present in vocabulary")
+
+        if not exact and self.ann is not None:
+            rows = [wv.key_to_index[key] for key in keys]
+            query = IVFIndex.normalize(wv.vectors[rows]).mean(axis=0)
+            similar_books = self._search_ann(query, topn, rows)
+        else:
+            similar_books = wv.most_similar(positive=keys, topn=topn)
+        return self._to_dataframe(similar_books)
+
+    def _search_ann(self, vector, topn: int, exclude: list) -> list:
+        indices, similarities = self.ann.search(vector, topn, exclude=exclude)
+        return [
+            (self.wv.index_to_key[i], float(s)) for i, s in zip(indices, similarities)
+        ]
+
+    def _encode(self, book_id):
+        """Key of a book id in the model, or None if it has none"""
+        return book_id if self.string_keys else self.book_ids.get(book_id)
+
+    def _to_dataframe(self, similar_books) -> pd.DataFrame:
         df = pd.DataFrame(similar_books, columns=["book_id", "similarity"])
+        if not self.string_keys:
+            # integer ids back to book ids
+            df.book_id = self.book_ids.decode(df.book_id)
         df.similarity = (df.similarity * 100).round(2)
         return df
 
     def objective(self, trial):
-        params = {
-            "size": trial.suggest_int("size", 50, 300),
-            "window": trial.suggest_int("window", 5, 30),
-            "epochs": trial.suggest_int("epochs", 5, 20),
-            "negative_size": trial.suggest_int("negative_size", 5, 20),
-            "model_type": trial.suggest_categorical("model_type", ["cbow"]),
-            "approximation": trial.suggest_categorical("approximation", ["negative"]),
-            "hs": trial.suggest_categorical("hs", ["negative"]),
-            "sg": trial.suggest_categorical("sg", ["cbow"]),
-            "min_count": 1,
-        }
+        # trials train on the corpus preprocessed like train_model does
+        params = {name: self.default_params[name] for name in self.CORPUS_PARAMS}
+        params.update(
+            {
+                "size": trial.suggest_int("size", 50, 300),
+                "window": trial.suggest_int("window", 5, 30),
+                "epochs": trial.suggest_int("epochs", 5, 20),
+                "negative_size": trial.suggest_int("negative_size", 5, 20),
+                "model_type": trial.suggest_categorical("model_type", ["cbow"]),
+                "approximation": trial.suggest_categorical(
+                    "approximation", ["negative"]
+                ),
+                "hs": trial.suggest_categorical("hs", ["negative"]),
+                "sg": trial.suggest_categorical("sg", ["cbow"]),
+                "workers": self.trial_threads,
+            }
+        )
 
-        model = Word2Vec(**self._get_model_params(params))
+        model_params = self._get_model_params(params)
+        model_params["callbacks"] = [PruningCallback(trial)]
+        model = Word2Vec(**model_params)
         return model.get_latest_training_loss()
 
-    def optimize(self, n_trials=100):
-        if not self.sentences:
+    def optimize(self, n_trials=100, n_jobs=1, storage=None, trial_threads=None):
+        """
+        Search the hyperparameters with Optuna and save the best ones.
+
+        :param n_jobs: Number of worker processes running trials in parallel.
+                       They share the study through storage and train from the
+                       local corpus snapshot.
+        :param storage: Optuna storage URL. Defaults to OPTUNA_STORAGE when n_jobs > 1.
+        :param trial_threads: gensim worker threads per trial.
+                              Defaults to the number of CPUs divided by n_jobs.
+        """
+        if n_jobs > 1 and not isinstance(self.sentences, CorpusSnapshot):
+            # worker processes read the corpus from the local snapshot
+            self.use_snapshot = True
+            self.sentences = None
+        if self.sentences is None:
             self._generate_sentences()
 
-        study = optuna.create_study(direction="minimize")
-        study.optimize(self.objective, n_trials=n_trials)
+        self.trial_threads = trial_threads or max(1, (os.cpu_count() or 1) // n_jobs)
+        if n_jobs > 1:
+            storage = storage or self.OPTUNA_STORAGE
+        pruner = optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+        study = optuna.create_study(
+            storage=storage,
+            study_name=f"book2vec-{time.strftime('%Y%m%d-%H%M%S')}",
+            direction="minimize",
+            pruner=pruner,
+        )
+
+        if n_jobs > 1:
+            processes = [
+                multiprocessing.Process(
+                    target=_optimize_worker,
+                    args=(
+                        self.sentences,
+                        self.default_params,
+                        self.trial_threads,
+                        study.study_name,
+                        storage,
+                        pruner,
+                        n_trials // n_jobs + (i < n_trials % n_jobs),
+                    ),
+                )
+                for i in range(n_jobs)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+            failed = [
+                f"worker {i} (exit code {process.exitcode})"
+                for i, process in enumerate(processes)
+                if process.exitcode != 0
+            ]
+            if failed:
+                raise Exception(
+                    f"Optimization workers failed: {', '.join(failed)}. "
+                    f"Completed trials are kept in study {study.study_name} ({storage})."
+                )
+            study = optuna.load_study(study_name=study.study_name, storage=storage)
+        else:
+            study.optimize(self.objective, n_trials=n_trials)
 
         print(f"Best parameters: {study.best_params}")
         print(f"Best loss: {study.best_value}")
-        self.save_parameters(study.best_params)
+        # saved with the corpus options the trials were trained with
+        self.save_parameters(dict(self.default_params, **study.best_params))
 
     def save_parameters(self, params):
         with open("book2vec_ver.params", "w") as f:
@@ -124,5 +630,6 @@ class Model:
     def update_parameters(self):
         with open("book2vec_ver.params", "r") as f:
             params = eval(f.read())
-        self.default_params = params
+        # files saved without the corpus options keep the current ones
+        self.default_params = dict(self.default_params, **params)
         print(f"Parameters updated: {self.default_params}")
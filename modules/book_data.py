@@ -7,6 +7,8 @@ from bs4 import BeautifulSoup
 
 class BookData:
     GOOGLE_BOOKS_URL = "https://www.googleapis.com/books/v1/volumes?q={}"
+    # source name of Google Books lookups recorded with Database.record_lookups
+    GOOGLE_BOOKS_SOURCE = "google_books"
     AMAZON_URL = "https://www.amazon.co.jp/dp/{}"
     COLUMN_NAMES = [
         "title",
@@ -18,20 +20,34 @@ class BookData:
         "identifier",
     ]
 
-    def __init__(self, book_id: str):
+    def __init__(self, book_id: str, db=None, row=None):
+        """
+        Args:
+            book_id (str): book id
+            db (Database, optional): database to use. Defaults to the shared one.
+            row (dict, optional): book document already fetched from the database.
+        """
         self.wait_time = 1
-        self.db = Database()
+        self.db = db or Database()
         self.book_id = book_id
+        self.row = row
 
     def _get_current_data(self) -> pd.DataFrame:
-        row = self.db.get_book(self.book_id)
+        row = self.row if self.row is not None else self.db.get_book(self.book_id)
         return pd.DataFrame([row], columns=self.COLUMN_NAMES)
 
     def get_data(self) -> dict:
         db_data = self._get_current_data()
 
-        if db_data.isnull().values.any():
+        if db_data.isnull().values.any() and self.db.filter_lookups_due(
+            [self.book_id], self.GOOGLE_BOOKS_SOURCE
+        ):
             google_data = self._fetch_data_from_google_books()
+            if google_data is None:
+                result = "failed"
+            else:
+                result = "found" if google_data else "not_found"
+            self.db.record_lookups(self.GOOGLE_BOOKS_SOURCE, {self.book_id: result})
             if google_data:
                 self.db.update_book(self.book_id, **google_data)
                 return google_data
@@ -60,25 +76,33 @@ class BookData:
         return {"title": title}  # , "authors": ", ".join(authors)}  #  "page": page}
 
     def _fetch_data_from_google_books(self) -> dict:
+        """
+        :return: Metadata, an empty dict if Google Books has no such book,
+                 or None if the request failed.
+        """
         response = requests.get(self.GOOGLE_BOOKS_URL.format(self.book_id))
         sleep(self.wait_time)
 
-        if response.status_code != 200 or not response.json().get("totalItems"):
+        if response.status_code != 200:
+            print("error", response.status_code, response.text, sep="\n")
+            return None
+        if not response.json().get("totalItems"):
             return {}
 
         return self._parse_google_books_response(response.json())
 
-    def _parse_google_books_response(self, json_data) -> dict:
+    @classmethod
+    def _parse_google_books_response(cls, json_data) -> dict:
         for item in json_data.get("items", []):
             volume_info = item.get("volumeInfo", {})
             book_data = {
                 "title": volume_info.get("title"),
-                "authors": self._format_authors(volume_info.get("authors")),
+                "authors": cls._format_authors(volume_info.get("authors")),
                 "published_date": volume_info.get("publishedDate"),
                 "page": volume_info.get("pageCount"),
                 "print_type": volume_info.get("printType"),
                 "description": volume_info.get("description"),
-                "identifier": self._extract_identifier(
+                "identifier": cls._extract_identifier(
                     volume_info.get("industryIdentifiers")
                 ),
             }
@@ -0,0 +1,97 @@
+from modules.http_session import Throttle, create_session
+
+try:
+    import ijson
+except ImportError:  # optional: shelves are parsed with response.json()
+    ijson = None
+
+
+class BookshelfLoader:
+    """
+    Fetch users' bookshelves from the Booklog JSON API.
+
+    All requests share one requests.Session whose connection pool keeps up
+    to `concurrency` connections alive for the threads calling load, and a
+    request starts at least `delay` seconds after the previous one. Large
+    shelves are parsed while they are downloaded when ijson is installed.
+    """
+
+    API_URL = "https://api.booklog.jp/json/{}"
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        delay: float = 0.5,
+        category=0,
+        count=99999,
+        status=0,
+        rank=0,
+        url: str = API_URL,
+        timeout: float = 60,
+        max_retries: int = 3,
+    ):
+        """
+        Args:
+            concurrency (int): number of threads calling load (connection pool size)
+            delay (float): minimum interval between requests in seconds
+            category, count, status, rank: query parameters of the API
+            url (str): API URL with a {} placeholder for the user id (e.g. a local stub)
+            timeout (float): timeout of one request in seconds
+            max_retries (int): retries on connection errors, 429 and 5xx
+        """
+        self.concurrency = concurrency
+        self.throttle = Throttle(delay)
+        self.params = {
+            "category": category,
+            "status": status,
+            "rank": rank,
+            "count": count,
+        }
+        self.url = url
+        self.timeout = timeout
+        self.session = create_session(concurrency, max_retries)
+
+    def close(self):
+        self.session.close()
+
+    @staticmethod
+    def format_book(book: dict) -> dict:
+        return {
+            "BOOK_ID": book["url"].split("/")[-1],
+            "TITLE": book["title"],
+        }
+
+    def load(self, user_id: str) -> list[dict]:
+        """
+        Get the books of a user.
+
+        Args:
+            user_id (str): user id
+
+        Returns:
+            list[dict]: BOOK_ID and TITLE of each book. Empty if the user was not found.
+
+        Raises:
+            Exception: on any other error response, e.g. 429 or 5xx after the
+                retries, so that the user is not saved with an empty shelf.
+        """
+        self.throttle.wait()
+        with self.session.get(
+            self.url.format(user_id),
+            params=self.params,
+            timeout=self.timeout,
+            stream=ijson is not None,
+        ) as response:
+            if response.status_code == 404:
+                return []
+            if response.status_code != 200:
+                raise Exception(f"HTTP {response.status_code} \n User: {user_id}")
+            try:
+                if ijson is not None:
+                    response.raw.decode_content = True
+                    books = ijson.items(response.raw, "books.item")
+                else:
+                    books = response.json().get("books", [])
+                return [self.format_book(book) for book in books]
+            except Exception as e:
+                raise Exception(f"Error: {e} \n User: {user_id}")
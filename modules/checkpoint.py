@@ -0,0 +1,163 @@
+import json
+import sqlite3
+import threading
+
+
+class CrawlCheckpoint:
+    """
+    Persisted state of a crawl, kept in a local SQLite file.
+
+    - frontier: the result of every discovery step (ranking pages, reviewers
+      of a book, users of a tag) is stored under a key, so a restarted crawl
+      reads it back instead of requesting the page again.
+    - done: keys of the steps that were completed (a book, a tag, a year).
+    - seen users: users already in the database, loaded in bulk at startup,
+      and users saved during the crawl.
+    - users in flight: users handed out by track and not completed yet.
+
+    Every change is committed at once, so after a crash the crawl restarts
+    exactly where it stopped. The checkpoint can be shared by threads.
+    """
+
+    def __init__(self, path: str = "crawl_checkpoint.db"):
+        """
+        Args:
+            path (str): SQLite file. Use a separate file for each crawl script.
+        """
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS frontier (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS done (key TEXT PRIMARY KEY);
+            """
+        )
+        self.conn.commit()
+        self.seen_users = set()
+        # key -> users of the step not completed yet
+        self._pending = {}
+        self._failed = set()
+        # user in flight -> keys of the steps waiting for the user
+        self._waiting = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def get_or_fetch(self, key: str, fetch) -> list:
+        """
+        Return the stored result of a discovery step, or run and store it.
+
+        Args:
+            key (str): key of the step (e.g. "ranking/2015")
+            fetch (callable): function returning a JSON-serializable list
+
+        Returns:
+            list: result of the step
+        """
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.set(key, value)
+        return value
+
+    def get(self, key: str):
+        """Stored result of a discovery step, or None"""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT value FROM frontier WHERE key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def set(self, key: str, value):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO frontier (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+
+    def is_done(self, key: str) -> bool:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT 1 FROM done WHERE key = ?", (key,)
+            ).fetchone()
+        return row is not None
+
+    def mark_done(self, key: str):
+        with self._lock, self.conn:
+            self.conn.execute("INSERT OR IGNORE INTO done (key) VALUES (?)", (key,))
+
+    def load_seen_users(self, db) -> int:
+        """
+        Load the ids of the users already in the database with one query.
+
+        Args:
+            db (Database): database
+
+        Returns:
+            int: number of seen users
+        """
+        self.seen_users.update(db.iter_user_ids())
+        return len(self.seen_users)
+
+    def is_seen(self, user_id: str) -> bool:
+        return user_id in self.seen_users
+
+    def mark_seen(self, user_id: str):
+        self.seen_users.add(user_id)
+
+    def track(self, key: str, users) -> list:
+        """
+        Register the users found by a step. The step is marked done once all
+        of its users not seen yet are completed (see complete); a step
+        without such users is marked done at once.
+
+        Returns:
+            list: users to fetch, without duplicates, in order. Users already
+                  in flight for another step are not returned again; the step
+                  waits for them as well.
+        """
+        with self._lock:
+            users = [u for u in dict.fromkeys(users) if u not in self.seen_users]
+            if not users:
+                self.mark_done(key)
+                return []
+            self._pending[key] = set(users)
+            new_users = []
+            for user in users:
+                if user not in self._waiting:
+                    self._waiting[user] = set()
+                    new_users.append(user)
+                self._waiting[user].add(key)
+            return new_users
+
+    def complete(self, user: str, ok: bool = True):
+        """
+        Mark a user handed out by track as processed. A saved user is seen from
+        now on. A failed one is not, so another step may hand it out again,
+        and the steps waiting for it are not marked done, so they are retried
+        by the next run.
+        """
+        with self._lock:
+            if ok:
+                self.mark_seen(user)
+            for key in self._waiting.pop(user, ()):
+                users = self._pending.get(key)
+                if users is None:
+                    continue
+                users.discard(user)
+                if not ok:
+                    self._failed.add(key)
+                if not users:
+                    del self._pending[key]
+                    if key in self._failed:
+                        self._failed.discard(key)
+                    else:
+                        self.mark_done(key)
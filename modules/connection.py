@@ -0,0 +1,151 @@
+import atexit
+import threading
+import time
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from sshtunnel import SSHTunnelForwarder
+
+
+class ConnectionManager:
+    """
+    Process-wide MongoDB connection shared through a single SSH tunnel.
+
+    The tunnel and the client are started lazily on first use and reused by
+    every Database created with the same settings. The connection is checked
+    periodically and rebuilt when the tunnel drops, and everything is shut
+    down when the process exits.
+    """
+
+    _instances = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        ssh_host=None,
+        ssh_username=None,
+        ssh_pkey_path=None,
+        ssh_private_key_password=None,
+        mongo_host="127.0.0.1",
+        mongo_port=27017,
+        db_username=None,
+        db_password=None,
+        authSource=None,
+        max_pool_size=100,
+        health_check_interval=30,
+        client=None,
+    ):
+        """
+        :param ssh_host: SSH host of the tunnel. If None, connect to mongo_host directly.
+        :param max_pool_size: Maximum number of sockets in the MongoClient pool.
+        :param health_check_interval: Seconds between two health checks.
+        :param client: Ready-made client (e.g. mongomock) used instead of connecting.
+        """
+        self.ssh_host = ssh_host
+        self.ssh_username = ssh_username
+        self.ssh_pkey_path = ssh_pkey_path
+        self.ssh_private_key_password = ssh_private_key_password
+        self.mongo_host = mongo_host
+        self.mongo_port = mongo_port
+        self.db_username = db_username
+        self.db_password = db_password
+        self.authSource = authSource
+        self.max_pool_size = max_pool_size
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.RLock()
+        self._external_client = client is not None
+        self.server = None
+        self.client = client
+        self._last_check = time.monotonic()
+
+    @classmethod
+    def shared(cls, **config):
+        """Returns the manager for the given settings, creating it on first use"""
+        key = tuple(sorted(config.items()))
+        with cls._instances_lock:
+            manager = cls._instances.get(key)
+            if manager is None:
+                manager = cls(**config)
+                cls._instances[key] = manager
+            return manager
+
+    @classmethod
+    def close_all(cls):
+        """Closes every shared connection. Registered to run at process exit."""
+        with cls._instances_lock:
+            managers = list(cls._instances.values())
+            cls._instances.clear()
+        for manager in managers:
+            manager.close()
+
+    def get_client(self) -> MongoClient:
+        """Returns a healthy client, connecting or reconnecting if needed"""
+        with self._lock:
+            if self.client is None:
+                self._connect()
+            elif (
+                not self._external_client
+                and time.monotonic() - self._last_check > self.health_check_interval
+            ):
+                if not self.is_healthy():
+                    print("MongoDB connection lost. Reconnecting...")
+                    self._disconnect()
+                    self._connect()
+                self._last_check = time.monotonic()
+            return self.client  # type: ignore
+
+    def is_healthy(self) -> bool:
+        """Returns True if the tunnel is up and the server answers a ping"""
+        if self.client is None:
+            return False
+        if self.server is not None and not self.server.is_active:
+            return False
+        try:
+            self.client.admin.command("ping")
+        except PyMongoError:
+            return False
+        return True
+
+    def _connect(self):
+        host, port = self.mongo_host, self.mongo_port
+        if self.ssh_host:
+            self.server = SSHTunnelForwarder(
+                self.ssh_host,
+                ssh_username=self.ssh_username,
+                ssh_pkey=self.ssh_pkey_path,
+                ssh_private_key_password=self.ssh_private_key_password,
+                remote_bind_address=(self.mongo_host, self.mongo_port),
+                set_keepalive=15,
+            )
+            self.server.start()
+            # 使用するポートはSSHトンネルのローカルポート
+            host, port = "127.0.0.1", self.server.local_bind_port
+
+        credentials = {}
+        if self.db_username:
+            credentials = {
+                "username": self.db_username,
+                "password": self.db_password,
+                "authSource": self.authSource,
+            }
+        self.client = MongoClient(
+            host=host, port=port, maxPoolSize=self.max_pool_size, **credentials
+        )
+        self._last_check = time.monotonic()
+
+    def _disconnect(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+    def close(self):
+        with self._lock:
+            if self._external_client:
+                return
+            self._disconnect()
+
+
+atexit.register(ConnectionManager.close_all)
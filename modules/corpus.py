@@ -0,0 +1,247 @@
+import json
+import os
+import random
+from array import array
+from itertools import groupby
+import numpy as np
+from modules.database import Database
+from modules.id_dictionary import IdDictionary
+
+
+def group_by_user(rows):
+    """
+    Group user_books rows sorted by user_id into (user_id, book_ids).
+    Duplicate books are dropped while keeping the order of the shelf.
+    """
+    for user_id, user_rows in groupby(rows, key=lambda row: row.get("user_id")):
+        sentence = list(
+            dict.fromkeys(row["book_id"] for row in user_rows if row.get("book_id"))
+        )
+        if sentence:
+            yield user_id, sentence
+
+
+class ShelfChunks:
+    """
+    Sentences with the shelves longer than max_length split into chunks of at
+    most max_length books, so that the few users with huge shelves do not
+    dominate the corpus (gensim would also silently cut sentences after
+    10000 words).
+
+    "window" cuts a shelf into consecutive chunks in shelf order; "random"
+    shuffles it first, so that every chunk is a sample of the whole shelf.
+    The shuffle is seeded per shelf, so every pass yields the same chunks.
+    """
+
+    MODES = ("random", "window")
+
+    def __init__(self, sentences, max_length: int, mode: str = "random", seed=0):
+        if mode not in self.MODES:
+            raise ValueError(f"mode must be one of {self.MODES}")
+        self.sentences = sentences
+        self.max_length = max_length
+        self.mode = mode
+        self.seed = seed
+
+    def __iter__(self):
+        for i, sentence in enumerate(self.sentences):
+            n = len(sentence)
+            if n <= self.max_length:
+                yield sentence
+                continue
+            if self.mode == "random":
+                sentence = sentence[:]
+                random.Random(self.seed + i).shuffle(sentence)
+            # chunks of equal length rather than a short last one
+            size = -(-n // -(-n // self.max_length))
+            for start in range(0, n, size):
+                yield sentence[start : start + size]
+
+
+class UserBooksCorpus:
+    """
+    Sentences for book2vec streamed from MongoDB: one sentence per user,
+    holding the user's book ids.
+
+    The user_books collection is read with a cursor sorted by user_id and only
+    user_id/book_id projected, so memory does not grow with the collection.
+    Iterating again re-runs the query, which lets gensim make several passes.
+    If a book IdDictionary is given, sentences are array('i') of its integer
+    ids instead of lists of strings.
+    """
+
+    def __init__(self, db=None, batch_size=10000, books: IdDictionary = None):
+        self.db = db or Database()
+        self.batch_size = batch_size
+        self.books = books
+
+    def __iter__(self):
+        rows = self.db.iter_user_books_sorted_by_user(self.batch_size)
+        for _, sentence in group_by_user(rows):
+            yield sentence if self.books is None else self.books.encode(sentence)
+
+
+class CorpusSnapshot:
+    """
+    Local copy of the user -> books corpus, read memory-mapped.
+
+    Ids are integer-encoded: tokens.npy holds the book ids of every user
+    back to back and offsets.npy the start of each user's shelf, the shelf
+    of user i being the i-th. The book IdDictionary (books.txt unless one
+    shared with the model is given) and users.txt map them back to strings.
+    meta.json keeps a fingerprint of user_books (document count and largest
+    _id), so the snapshot can be brought up to date by reading only the new
+    documents, and the size and digest of the book dictionary, so that a
+    dictionary that lost ids is detected. Iterating yields one array('i') of book ids per user.
+    """
+
+    def __init__(self, path="corpus", books: IdDictionary = None):
+        self.path = path
+        self.books = (
+            books if books is not None else IdDictionary(self._file("books.txt"))
+        )
+        self._tokens = None
+        self._offsets = None
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def exists(self) -> bool:
+        return os.path.exists(self._file("meta.json"))
+
+    def read_meta(self) -> dict:
+        with open(self._file("meta.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _fingerprint(db) -> dict:
+        return {
+            "user_books": db.count_all_user_books(),
+            "last_id": db.get_last_user_books_id(),
+        }
+
+    def _write_array(self, name: str, data: np.ndarray):
+        with open(self._file(name) + ".tmp", "wb") as f:
+            np.save(f, data)
+        os.replace(self._file(name) + ".tmp", self._file(name))
+
+    def _write(self, users, tokens, offsets, meta):
+        os.makedirs(self.path, exist_ok=True)
+        self._tokens = self._offsets = None
+        users.save()
+        self.books.save()
+        self._write_array("tokens.npy", np.frombuffer(tokens, dtype=np.int32))
+        self._write_array("offsets.npy", np.frombuffer(offsets, dtype=np.int64))
+        meta = dict(
+            meta,
+            users=len(users),
+            books=len(self.books),
+            tokens=len(tokens),
+            book_ids=self.books.path,
+            book_ids_digest=self.books.digest(),
+        )
+        with open(self._file("meta.json") + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(self._file("meta.json") + ".tmp", self._file("meta.json"))
+
+    def export(self, db):
+        """
+        Write the whole corpus from the database.
+        Book ids already in the dictionary keep their integer ids.
+        """
+        meta = self._fingerprint(db)
+        users = IdDictionary(self._file("users.txt"), load=False)
+        tokens, offsets = array("i"), array("q", [0])
+        for user_id, sentence in group_by_user(db.iter_user_books_sorted_by_user()):
+            users.add(user_id)
+            tokens.extend(self.books.encode(sentence))
+            offsets.append(len(tokens))
+        self._write(users, tokens, offsets, meta)
+
+    def refresh(self, db) -> bool:
+        """
+        Bring the snapshot up to date.
+        Only documents added since the last export are read, unless documents
+        were deleted, in which case the whole corpus is exported again.
+
+        :return: True if the snapshot was changed.
+        """
+        if not self.exists():
+            self.export(db)
+            return True
+
+        old_meta = self.read_meta()
+        if old_meta.get("book_ids_digest") and not self.books.extends(
+            old_meta["books"], old_meta["book_ids_digest"]
+        ):
+            # e.g. the dictionary file was deleted or replaced by an older one
+            print(
+                f"{self.books.path} is not the dictionary the corpus snapshot was "
+                "encoded with. Exporting the whole corpus again."
+            )
+            self.export(db)
+            return True
+
+        meta = self._fingerprint(db)
+        if meta == {k: old_meta.get(k) for k in meta}:
+            return False
+
+        last_id = old_meta["last_id"]
+        if (
+            not last_id
+            # the tokens were encoded with another book dictionary
+            or old_meta.get("book_ids") != self.books.path
+            or old_meta["user_books"] + db.count_user_books_after(last_id)
+            != meta["user_books"]
+        ):
+            self.export(db)
+            return True
+
+        self._load()
+        n_users = len(self._offsets) - 1
+        users = IdDictionary(self._file("users.txt"))
+        new_books = {}
+        for row in db.iter_user_books_after(last_id):
+            if row.get("book_id"):
+                user = users.add(row.get("user_id"))
+                new_books.setdefault(user, []).append(self.books.add(row["book_id"]))
+
+        tokens, offsets = array("i"), array("q", [0])
+        for user in range(len(users)):
+            if user < n_users:
+                shelf = self._tokens[self._offsets[user] : self._offsets[user + 1]]
+                shelf = shelf.tolist()
+            else:
+                shelf = []
+            seen = set(shelf)
+            for book in new_books.get(user, ()):
+                if book not in seen:
+                    seen.add(book)
+                    shelf.append(book)
+            tokens.extend(shelf)
+            offsets.append(len(tokens))
+
+        self._write(users, tokens, offsets, meta)
+        return True
+
+    def _load(self):
+        if self._tokens is None:
+            self._tokens = np.load(self._file("tokens.npy"), mmap_mode="r")
+            self._offsets = np.load(self._file("offsets.npy"), mmap_mode="r")
+
+    def __len__(self):
+        self._load()
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        self._load()
+        tokens, offsets = self._tokens, self._offsets
+        for i in range(len(offsets) - 1):
+            # gensim needs a sequence it can test for emptiness, not an ndarray
+            yield array("i", tokens[offsets[i] : offsets[i + 1]].tobytes())
+
+    def __getstate__(self):
+        # memory maps are opened again in the process that unpickles the snapshot
+        state = self.__dict__.copy()
+        state.update(_tokens=None, _offsets=None)
+        return state
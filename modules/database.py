@@ -1,13 +1,36 @@
-from pymongo import MongoClient
-from sshtunnel import SSHTunnelForwarder
-from pymongo.errors import DuplicateKeyError
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from modules.connection import ConnectionManager
+from modules.cache import LRUCache
+from modules.normalize import normalize_text, search_keys
+import re
 
 
 class Database:
     """
     Database class for MongoDB
+
+    Every instance created with the same settings shares one SSH tunnel and
+    one MongoClient through ConnectionManager, so creating a Database is cheap.
+    Book documents are kept in a process-wide LRU cache (book_cache) which is
+    invalidated whenever a book is written through this class. Other processes
+    (e.g. the other web workers) don't see those invalidations, so books that
+    still wait for their metadata are only cached for INCOMPLETE_BOOK_TTL.
     """
 
+    book_cache = LRUCache(maxsize=10000, ttl=60 * 60)
+    # seconds a book without authors stays in book_cache
+    INCOMPLETE_BOOK_TTL = 60
+    # process-wide SearchIndex snapshot. If set, searches are answered from it.
+    # Books written after the snapshot are not in it until it is rebuilt.
+    search_index = None
+    # retry windows of lookups (see record_lookups), doubled after each miss
+    LOOKUP_RETRY_BASE = timedelta(hours=1)
+    LOOKUP_RETRY_MAX = timedelta(days=30)
+
     def __init__(
         self,
         ssh_host="####",
@@ -19,28 +42,54 @@ class Database:
         db_username="####",
         db_password="####",
         authSource="####",
+        manager=None,
     ):
-        self.server = SSHTunnelForwarder(
-            ssh_host,
+        """
+        :param manager: ConnectionManager to use instead of the shared one (e.g. for tests).
+        """
+        self.manager = manager or ConnectionManager.shared(
+            ssh_host=ssh_host,
             ssh_username=ssh_username,
-            ssh_pkey=ssh_pkey_path,
+            ssh_pkey_path=ssh_pkey_path,
             ssh_private_key_password=ssh_private_key_password,
-            remote_bind_address=(mongo_host, mongo_port),
-        )
-        self.server.start()
-
-        self.client = MongoClient(
-            host="127.0.0.1",
-            port=self.server.local_bind_port,  # 使用するポートはSSHトンネルのローカルポート
-            username=db_username,
-            password=db_password,
+            mongo_host=mongo_host,
+            mongo_port=mongo_port,
+            db_username=db_username,
+            db_password=db_password,
             authSource=authSource,
         )
 
-        self.db = self.client["booklog"]
-        self.users = self.db["users"]
-        self.books = self.db["books"]
-        self.user_books = self.db["user_books"]
+    @property
+    def client(self):
+        return self.manager.get_client()
+
+    @property
+    def db(self):
+        return self.client["booklog"]
+
+    @property
+    def users(self):
+        return self.db["users"]
+
+    @property
+    def books(self):
+        return self.db["books"]
+
+    @property
+    def user_books(self):
+        return self.db["user_books"]
+
+    @property
+    def lookups(self):
+        return self.db["lookups"]
+
+    @property
+    def enrichment_requests(self):
+        return self.db["enrichment_requests"]
+
+    @property
+    def locks(self):
+        return self.db["locks"]
 
     def __enter__(self):
         return self
@@ -56,10 +105,15 @@ class Database:
 
     def insert_book(self, book_id, title, authors=None):
         try:
-            data = {"_id": book_id, "title": title}
+            data = {
+                "_id": book_id,
+                "title": title,
+                "search_keys": search_keys(title, authors),
+            }
             if authors:
                 data["authors"] = authors
             self.books.insert_one(data)
+            self.book_cache.invalidate(book_id)
         except DuplicateKeyError as e:
             print(f"DuplicateKeyError: {e}")
 
@@ -69,6 +123,109 @@ class Database:
         except DuplicateKeyError as e:
             print(f"DuplicateKeyError: {e}")
 
+    def insert_user_shelf(self, user_id, books) -> dict:
+        """
+        Save a user and their whole shelf (see insert_user_shelves).
+
+        :param user_id: User id.
+        :param books: Iterable of (book_id, title).
+        :return: Counts of inserted and already existing (duplicate) books and user_books,
+                 and whether the user was inserted.
+        """
+        result = self.insert_user_shelves({user_id: books})
+        result["user_inserted"] = result.pop("users_inserted") == 1
+        return result
+
+    def insert_user_shelves(self, shelves: dict) -> dict:
+        """
+        Save users and their whole shelves with unordered bulk upserts:
+        one bulk write for the books, one for the user_books and one for the
+        users, which are written last so that a user in the database always
+        has their shelf saved. Writing the same shelves again changes nothing.
+
+        :param shelves: dict of user_id -> iterable of (book_id, title).
+        :return: Counts of inserted and already existing (duplicate) books and user_books,
+                 and the number of inserted users.
+        """
+        titles = {}
+        pairs = []
+        for user_id, books in shelves.items():
+            shelf = dict((book_id, title) for book_id, title in books if book_id)
+            pairs.extend((user_id, book_id) for book_id in shelf)
+            for book_id, title in shelf.items():
+                titles.setdefault(book_id, title)
+        result = {
+            "books_inserted": 0,
+            "books_duplicate": 0,
+            "user_books_inserted": 0,
+            "user_books_duplicate": 0,
+            "users_inserted": 0,
+        }
+        if titles:
+            book_ids = list(titles)
+            inserted = self._bulk_upsert(
+                self.books,
+                [
+                    UpdateOne(
+                        {"_id": book_id},
+                        {
+                            "$setOnInsert": {
+                                "title": titles[book_id],
+                                "search_keys": search_keys(titles[book_id]),
+                            }
+                        },
+                        upsert=True,
+                    )
+                    for book_id in book_ids
+                ],
+            )
+            for i in inserted:
+                self.book_cache.invalidate(book_ids[i])
+            result["books_inserted"] = len(inserted)
+            result["books_duplicate"] = len(book_ids) - len(inserted)
+
+            inserted = self._bulk_upsert(
+                self.user_books,
+                [
+                    UpdateOne(
+                        {"user_id": user_id, "book_id": book_id},
+                        {"$setOnInsert": {"user_id": user_id, "book_id": book_id}},
+                        upsert=True,
+                    )
+                    for user_id, book_id in pairs
+                ],
+            )
+            result["user_books_inserted"] = len(inserted)
+            result["user_books_duplicate"] = len(pairs) - len(inserted)
+
+        if shelves:
+            inserted = self._bulk_upsert(
+                self.users,
+                [
+                    ReplaceOne({"_id": user_id}, {"_id": user_id}, upsert=True)
+                    for user_id in shelves
+                ],
+            )
+            result["users_inserted"] = len(inserted)
+        return result
+
+    @staticmethod
+    def _bulk_upsert(collection, requests) -> list:
+        """
+        Run upserts as one unordered bulk write.
+        Upserts that lost a race against a concurrent insert of the same
+        document fail on the unique index and are counted as existing.
+
+        :return: Indexes of the requests that inserted a document.
+        """
+        try:
+            return list(collection.bulk_write(requests, ordered=False).upserted_ids)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            if any(error["code"] != 11000 for error in errors):
+                raise
+            return [upsert["index"] for upsert in e.details["upserted"]]
+
     def search_books_from_title(self, keyword: str):
         return list(self.books.find({"title": {"$regex": keyword, "$options": "i"}}))
 
@@ -84,9 +241,20 @@ class Database:
         Keywords can be space-separated and will be split to search individually.
 
         :param keywords: Space-separated string of keywords to search for.
-        :return: List of book_ids that match the search, sorted by their counts in user_books.
+        :return: List of book_ids that match the search, sorted by their counts in user_books
+                 (the count field maintained by update_book_counts).
         """
+        if self.search_index is not None:
+            return self.search_index.search(keywords, limit=4)
+
+        # Without the SearchIndex snapshot, keywords are matched on MongoDB as
+        # prefixes of a title or of an author, so that the search_keys index is
+        # used. Unlike the SearchIndex, which matches keywords anywhere, a
+        # keyword from the middle of a title (e.g. "猫" for "吾輩は猫である")
+        # finds nothing here.
         search_queries = self._generate_search_queries(keywords)
+        if not search_queries:
+            return []
 
         pipeline = self._construct_pipeline(search_queries)
 
@@ -97,19 +265,17 @@ class Database:
     def _generate_search_queries(self, keywords: str):
         """
         Generates a list of search queries for titles and authors based on provided keywords.
+        Keywords are normalized and matched as prefixes of the indexed search_keys
+        (the normalized title and authors), so the queries can use the index.
 
         :param keywords: Space-separated string of keywords.
         :return: List of search queries for MongoDB.
         """
-        keyword_list = keywords.split()
+        keyword_list = [normalize_text(keyword) for keyword in keywords.split()]
         return [
-            {
-                "$or": [
-                    {"title": {"$regex": keyword, "$options": "i"}},
-                    {"authors": {"$regex": keyword, "$options": "i"}},
-                ]
-            }
+            {"search_keys": {"$regex": "^" + re.escape(keyword)}}
             for keyword in keyword_list
+            if keyword
         ]
 
     def _construct_pipeline(self, search_queries: list):
@@ -121,18 +287,9 @@ class Database:
         """
         return [
             {"$match": {"$or": search_queries}},
-            {
-                "$lookup": {
-                    "from": "user_books",
-                    "localField": "_id",
-                    "foreignField": "book_id",
-                    "as": "entries",
-                }
-            },
-            # {"$addFields": {"count": {"$size": "$entries"}}},
-            # {"$sort": {"count": -1}},
-            # {"$project": {"_id": 1}},
+            {"$sort": {"count": -1}},
             {"$limit": 4},
+            {"$project": {"_id": 1}},
         ]
 
     def get_user_books(self, user_id):
@@ -141,8 +298,87 @@ class Database:
     def get_all_user_books(self):
         return list(self.user_books.find({}))
 
+    def iter_user_books_sorted_by_user(self, batch_size=10000):
+        """
+        Stream (user_id, book_id) pairs sorted by user_id.
+        The sort uses the user_id index created by ensure_indexes.
+        """
+        return self.user_books.find(
+            {}, {"_id": 0, "user_id": 1, "book_id": 1}, batch_size=batch_size
+        ).sort("user_id", 1)
+
+    def iter_user_books_of_users(self, user_ids, batch_size=10000):
+        """Stream (user_id, book_id) pairs of the given users, sorted by user_id"""
+        return self.user_books.find(
+            {"user_id": {"$in": list(user_ids)}},
+            {"_id": 0, "user_id": 1, "book_id": 1},
+            batch_size=batch_size,
+        ).sort("user_id", 1)
+
+    def iter_user_books_after(self, last_id=None, batch_size=10000):
+        """
+        Stream user_books documents inserted after last_id, in insertion (_id) order.
+
+        :param last_id: String of an ObjectId returned by get_last_user_books_id.
+                        If None, every document is returned.
+        """
+        query = {"_id": {"$gt": ObjectId(last_id)}} if last_id else {}
+        return self.user_books.find(
+            query, {"user_id": 1, "book_id": 1}, batch_size=batch_size
+        ).sort("_id", 1)
+
+    def get_last_user_books_id(self):
+        """Returns the largest user_books _id as a string, or None if empty"""
+        doc = self.user_books.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        return str(doc["_id"]) if doc else None
+
+    def count_user_books_after(self, last_id):
+        return self.user_books.count_documents({"_id": {"$gt": ObjectId(last_id)}})
+
     def get_book(self, book_id):
-        return self.books.find_one({"_id": book_id})
+        book = self.book_cache.get(book_id)
+        if book is None:
+            book = self.books.find_one({"_id": book_id})
+            if book is None:
+                return None
+            self._cache_book(book)
+        # Return a copy so that callers can't modify the cached document
+        return dict(book)
+
+    def get_books_bulk(self, book_ids) -> "OrderedDict[str, dict]":
+        """
+        Fetch several books with a single $in query.
+
+        :param book_ids: Iterable of book_ids.
+        :return: OrderedDict of book_id -> book document, in the order of book_ids.
+                 Books that are not found are omitted.
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        found = {}
+        for book_id in book_ids:
+            book = self.book_cache.get(book_id)
+            if book is not None:
+                found[book_id] = book
+
+        missing = [book_id for book_id in book_ids if book_id not in found]
+        if missing:
+            for book in self.books.find({"_id": {"$in": missing}}):
+                self._cache_book(book)
+                found[book["_id"]] = book
+
+        return OrderedDict(
+            (book_id, dict(found[book_id])) for book_id in book_ids if book_id in found
+        )
+
+    def _cache_book(self, book):
+        # books without authors are enriched soon, possibly by another process
+        ttl = None if book.get("authors") else self.INCOMPLETE_BOOK_TTL
+        self.book_cache.set(book["_id"], book, ttl=ttl)
+
+    def iter_user_ids(self, batch_size=10000):
+        """Stream the ids of all users"""
+        cursor = self.users.find({}, {"_id": 1}, batch_size=batch_size)
+        return (user["_id"] for user in cursor)
 
     def get_user(self, user_id):
         return self.users.find_one({"_id": user_id})
@@ -155,6 +391,11 @@ class Database:
         book = self.books.find_one({"title": title})
         return book["_id"] if book else None
 
+    def iter_books_for_search_index(self, batch_size=10000):
+        return self.books.find(
+            {}, {"title": 1, "authors": 1, "count": 1}, batch_size=batch_size
+        )
+
     def get_book_ids_without_authors(self):
         # booksテーブルのすべての_idとタイトルを取得。ただし、authorsがあるものは除く
         book_ids = self.books.find(
@@ -177,6 +418,103 @@ class Database:
     def count_books_not_having_count(self):
         return self.books.count_documents({"count": {"$exists": False}})
 
+    def update_book_counts(self, full=False, batch_size=1000):
+        """
+        Maintain books.count, the number of user_books of each book.
+        Only user_books added since the last run are counted, unless full is True.
+
+        A run can be interrupted and run again without counting user_books twice:
+        the range being counted is recorded before the counts are written, each
+        book records the end of the last range added to its count (count_id),
+        and an interrupted full recount is finished before counting incrementally.
+
+        :param full: Recount everything (e.g. after user_books were deleted).
+        :return: Number of books whose count was changed.
+        """
+        meta = self.db["meta"]
+        state = meta.find_one({"_id": "book_counts"}) or {}
+        watermark = self.get_last_user_books_id()
+        if watermark is None:
+            return 0
+
+        if full or state.get("full_to") or not state.get("last_user_books_id"):
+            meta.update_one(
+                {"_id": "book_counts"}, {"$set": {"full_to": watermark}}, upsert=True
+            )
+            updated = self._write_book_counts(None, watermark, batch_size, full=True)
+            meta.update_one(
+                {"_id": "book_counts"},
+                {
+                    "$set": {"last_user_books_id": watermark},
+                    "$unset": {"full_to": "", "pending_to": ""},
+                },
+            )
+            return updated
+
+        updated = 0
+        last_id = state["last_user_books_id"]
+        # finish the range of an interrupted run first
+        for end in filter(None, [state.get("pending_to"), watermark]):
+            if ObjectId(end) <= ObjectId(last_id):
+                continue
+            meta.update_one({"_id": "book_counts"}, {"$set": {"pending_to": end}})
+            updated += self._write_book_counts(last_id, end, batch_size)
+            meta.update_one(
+                {"_id": "book_counts"},
+                {"$set": {"last_user_books_id": end}, "$unset": {"pending_to": ""}},
+            )
+            last_id = end
+
+        # books without any user_books yet
+        self.books.update_many({"count": {"$exists": False}}, {"$set": {"count": 0}})
+        return updated
+
+    def _write_book_counts(self, start, end, batch_size, full=False) -> int:
+        """
+        Count the user_books with start < _id <= end per book. A full count sets
+        the counts and zeroes the books without user_books, otherwise the counts
+        are added, except to books that already have count_id == end.
+
+        :return: Number of books whose count was changed.
+        """
+        match = {"$lte": ObjectId(end)}
+        if start:
+            match["$gt"] = ObjectId(start)
+        pipeline = [
+            {"$match": {"_id": match}},
+            {"$group": {"_id": "$book_id", "count": {"$sum": 1}}},
+        ]
+
+        updated = 0
+        requests = []
+        # a full count marks the books it set with an id of its own, so that
+        # books counted by an earlier run at the same watermark are zeroed too
+        marker = str(ObjectId()) if full else end
+        for row in self.user_books.aggregate(pipeline, allowDiskUse=True):
+            if full:
+                request = UpdateOne(
+                    {"_id": row["_id"]},
+                    {"$set": {"count": row["count"], "count_id": marker}},
+                )
+            else:
+                request = UpdateOne(
+                    {"_id": row["_id"], "count_id": {"$ne": end}},
+                    {"$inc": {"count": row["count"]}, "$set": {"count_id": end}},
+                )
+            requests.append(request)
+            if len(requests) >= batch_size:
+                updated += self.books.bulk_write(requests, ordered=False).modified_count
+                requests = []
+        if requests:
+            updated += self.books.bulk_write(requests, ordered=False).modified_count
+
+        if full:
+            updated += self.books.update_many(
+                {"count_id": {"$ne": marker}},
+                {"$set": {"count": 0, "count_id": marker}},
+            ).modified_count
+        return updated
+
     def is_book_exists(self, book_id):
         return bool(self.get_book(book_id))
 
@@ -184,13 +522,273 @@ class Database:
         return bool(self.get_user(user_id))
 
     def update_book(self, book_id, **kwargs):
-        update_fields = {k: v for k, v in kwargs.items() if v is not None}
-        if update_fields:
-            self.books.update_one({"_id": book_id}, {"$set": update_fields})
+        self.update_books({book_id: kwargs})
+
+    def update_books(self, updates: dict):
+        """
+        Update several books with one unordered bulk write.
+
+        :param updates: dict of book_id -> fields to set. None values are ignored.
+        :return: Number of modified books.
+        """
+        updates = {
+            book_id: {k: v for k, v in fields.items() if v is not None}
+            for book_id, fields in updates.items()
+        }
+        updates = {book_id: fields for book_id, fields in updates.items() if fields}
+        if not updates:
+            return 0
+
+        # search_keys depend on both title and authors
+        books = self.get_books_bulk(
+            book_id
+            for book_id, fields in updates.items()
+            if "title" in fields or "authors" in fields
+        )
+        requests = []
+        for book_id, fields in updates.items():
+            if "title" in fields or "authors" in fields:
+                book = dict(books.get(book_id, {}), **fields)
+                fields["search_keys"] = search_keys(
+                    book.get("title"), book.get("authors")
+                )
+            requests.append(UpdateOne({"_id": book_id}, {"$set": fields}))
+
+        result = self.books.bulk_write(requests, ordered=False)
+        for book_id in updates:
+            self.book_cache.invalidate(book_id)
+        return result.modified_count
+
+    def backfill_search_keys(self, full=False, batch_size=1000):
+        """
+        Store search_keys for books written before they were introduced.
+
+        :param full: Recompute the keys of every book (e.g. after the normalization changed).
+        :return: Number of updated books.
+        """
+        query = {} if full else {"search_keys": {"$exists": False}}
+        updated = 0
+        requests = []
+        for book in self.books.find(query, {"title": 1, "authors": 1}):
+            keys = search_keys(book.get("title"), book.get("authors"))
+            requests.append(
+                UpdateOne({"_id": book["_id"]}, {"$set": {"search_keys": keys}})
+            )
+            if len(requests) >= batch_size:
+                updated += self.books.bulk_write(requests, ordered=False).modified_count
+                requests = []
+        if requests:
+            updated += self.books.bulk_write(requests, ordered=False).modified_count
+        self.book_cache.clear()
+        return updated
+
+    def filter_lookups_due(self, book_ids, source: str, batch_size=1000) -> list:
+        """
+        Drop the books that should not be looked up from source yet, because
+        their last lookup is still inside its retry window.
+
+        :param book_ids: Iterable of book_ids.
+        :param source: Name of the external source (e.g. "google_books").
+        :return: List of book_ids to look up, in the order of book_ids.
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        now = datetime.now(timezone.utc)
+        waiting = set()
+        for i in range(0, len(book_ids), batch_size):
+            query = {
+                "source": source,
+                "book_id": {"$in": book_ids[i : i + batch_size]},
+                "next_attempt": {"$gt": now},
+            }
+            waiting.update(doc["book_id"] for doc in self.lookups.find(query))
+        return [book_id for book_id in book_ids if book_id not in waiting]
+
+    def record_lookups(self, source: str, results: dict):
+        """
+        Record the results of lookups from an external source.
+
+        A book that was not found is not looked up again for LOOKUP_RETRY_BASE,
+        doubled with each consecutive miss up to LOOKUP_RETRY_MAX. A found book
+        is not looked up again for LOOKUP_RETRY_MAX. A failed lookup (the source
+        gave no answer, e.g. an error or an exhausted quota) is not a miss: the
+        attempt is counted, but the retry window and the misses are kept.
+
+        :param source: Name of the external source (e.g. "google_books").
+        :param results: dict of book_id -> "found", "not_found" or "failed".
+        """
+        if not results:
+            return
+        misses = {
+            doc["book_id"]: doc.get("misses", 0)
+            for doc in self.lookups.find(
+                {"source": source, "book_id": {"$in": list(results)}}
+            )
+        }
+        now = datetime.now(timezone.utc)
+        requests = []
+        for book_id, result in results.items():
+            if result == "failed":
+                requests.append(
+                    UpdateOne(
+                        {"source": source, "book_id": book_id},
+                        {
+                            "$set": {"last_attempted": now},
+                            "$setOnInsert": {"result": result, "misses": 0},
+                            "$inc": {"attempts": 1},
+                        },
+                        upsert=True,
+                    )
+                )
+                continue
+            if result == "found":
+                miss_count, retry = 0, self.LOOKUP_RETRY_MAX
+            else:
+                miss_count = misses.get(book_id, 0) + 1
+                retry = min(
+                    self.LOOKUP_RETRY_BASE * 2 ** min(miss_count - 1, 16),
+                    self.LOOKUP_RETRY_MAX,
+                )
+            requests.append(
+                UpdateOne(
+                    {"source": source, "book_id": book_id},
+                    {
+                        "$set": {
+                            "result": result,
+                            "last_attempted": now,
+                            "next_attempt": now + retry,
+                            "misses": miss_count,
+                        },
+                        "$inc": {"attempts": 1},
+                    },
+                    upsert=True,
+                )
+            )
+        self.lookups.bulk_write(requests, ordered=False)
+
+    def request_enrichment(self, book_ids):
+        """
+        Queue books for the enricher shared by all processes (see EnrichmentQueue).
+
+        :param book_ids: Iterable of book_ids. Books already queued keep their place.
+        """
+        now = datetime.now(timezone.utc)
+        requests = [
+            UpdateOne(
+                {"_id": book_id}, {"$setOnInsert": {"requested_at": now}}, upsert=True
+            )
+            for book_id in dict.fromkeys(book_ids)
+        ]
+        if requests:
+            self.enrichment_requests.bulk_write(requests, ordered=False)
+
+    def pop_enrichment_requests(self, limit: int) -> list:
+        """
+        Take the oldest queued books off the queue of request_enrichment.
+
+        :param limit: Maximum number of books.
+        :return: List of book_ids.
+        """
+        book_ids = [
+            doc["_id"]
+            for doc in self.enrichment_requests.find({}, {"_id": 1})
+            .sort("requested_at", 1)
+            .limit(limit)
+        ]
+        if book_ids:
+            self.enrichment_requests.delete_many({"_id": {"$in": book_ids}})
+        return book_ids
+
+    def acquire_lock(self, name: str, owner: str, duration: timedelta) -> bool:
+        """
+        Take or renew a lock shared by all processes. A lock that its owner did
+        not renew within duration (e.g. the process died) can be taken by another owner.
+
+        :param name: Name of the lock.
+        :param owner: Unique name of the caller (e.g. host and process id).
+        :param duration: Time until the lock expires if it is not renewed.
+        :return: True if owner holds the lock.
+        """
+        now = datetime.now(timezone.utc)
+        try:
+            self.locks.update_one(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lte": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + duration}},
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # held by another owner
+            return False
+        return True
+
+    def get_lookup_stats(self) -> dict:
+        """
+        :return: dict of source -> number of books by the result of their last lookup,
+                 and hit_rate, the ratio of found books.
+        """
+        pipeline = [
+            {
+                "$group": {
+                    "_id": {"source": "$source", "result": "$result"},
+                    "count": {"$sum": 1},
+                }
+            }
+        ]
+        stats = {}
+        for row in self.lookups.aggregate(pipeline):
+            source = stats.setdefault(row["_id"]["source"], {})
+            source[row["_id"]["result"]] = row["count"]
+        for source in stats.values():
+            source["hit_rate"] = source.get("found", 0) / sum(source.values())
+        return stats
+
+    def remove_duplicate_user_books(self) -> int:
+        """
+        Delete user_books documents repeating a (user_id, book_id) pair,
+        keeping the first one.
+
+        :return: Number of deleted documents.
+        """
+        pipeline = [
+            {
+                "$group": {
+                    "_id": {"user_id": "$user_id", "book_id": "$book_id"},
+                    "ids": {"$push": "$_id"},
+                    "count": {"$sum": 1},
+                }
+            },
+            {"$match": {"count": {"$gt": 1}}},
+        ]
+        removed = 0
+        for row in self.user_books.aggregate(pipeline, allowDiskUse=True):
+            duplicates = sorted(row["ids"])[1:]
+            removed += self.user_books.delete_many(
+                {"_id": {"$in": duplicates}}
+            ).deleted_count
+        return removed
 
     def delete_book(self, book_id):
         self.books.delete_one({"_id": book_id})
+        self.book_cache.invalidate(book_id)
+
+    def ensure_indexes(self):
+        """Creates the indexes used by the queries of this class"""
+        # unique, so that writing a shelf twice can't duplicate user_books.
+        # It also serves the queries sorted by user_id.
+        try:
+            self.user_books.create_index([("user_id", 1), ("book_id", 1)], unique=True)
+        except OperationFailure as e:
+            if e.code != 11000:
+                raise
+            # deleting documents is left to an explicit run of _dedupe_user_books.py
+            print(
+                "user_books has duplicate (user_id, book_id) pairs, so its unique "
+                "index was not created. Run _dedupe_user_books.py."
+            )
+        self.books.create_index([("count", -1)])
+        self.books.create_index("search_keys")
+        self.lookups.create_index([("source", 1), ("book_id", 1)], unique=True)
+        self.enrichment_requests.create_index("requested_at")
 
     def close(self):
-        self.client.close()
-        self.server.stop()
+        # The connection is shared with other instances and closed at process exit
+        pass
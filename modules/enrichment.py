@@ -0,0 +1,305 @@
+import asyncio
+import os
+import queue
+import random
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+import aiohttp
+from modules.book_data import BookData
+from modules.database import Database
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter for asyncio: allows `rate` requests per second
+    on average and bursts of up to `capacity` requests.
+    """
+
+    def __init__(self, rate: float, capacity: int = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class GoogleBooksEnricher:
+    """
+    Fill in book metadata from the Google Books API concurrently.
+
+    Requests run on a bounded number of workers behind a token-bucket rate
+    limiter, 429 and 5xx responses are retried with exponential backoff, and
+    results are written to MongoDB in batched bulk writes. The result of
+    every lookup is recorded with Database.record_lookups, and books whose
+    last lookup missed are skipped until their retry window has passed.
+    """
+
+    SOURCE = BookData.GOOGLE_BOOKS_SOURCE
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+        self,
+        db=None,
+        concurrency: int = 8,
+        rate: float = 5.0,
+        max_retries: int = 5,
+        batch_size: int = 100,
+        url: str = BookData.GOOGLE_BOOKS_URL,
+        timeout: float = 30,
+    ):
+        """
+        Args:
+            db (Database, optional): database to write to. Defaults to the shared one.
+            concurrency (int): number of requests in flight.
+            rate (float): requests per second.
+            max_retries (int): retries of a request on 429/5xx or network errors.
+            batch_size (int): number of books written per bulk write.
+            url (str): API URL with a {} placeholder for the book id (e.g. a local fake server).
+            timeout (float): timeout of one request in seconds.
+        """
+        self.db = db or Database()
+        self.concurrency = concurrency
+        self.rate = rate
+        self.max_retries = max_retries
+        self.batch_size = batch_size
+        self.url = url
+        self.timeout = timeout
+
+    def run(self, book_ids) -> dict:
+        """
+        Fetch and store the metadata of the books.
+
+        Returns:
+            dict: counts of found, not found, failed and skipped books
+        """
+        return asyncio.run(self.enrich(book_ids))
+
+    async def enrich(self, book_ids) -> dict:
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        bucket = TokenBucket(self.rate, capacity=self.concurrency)
+        stats = {"found": 0, "not_found": 0, "failed": 0, "skipped": 0}
+        pending, results = {}, {}
+
+        async def flush():
+            updates, lookups = dict(pending), dict(results)
+            pending.clear()
+            results.clear()
+            if updates:
+                await asyncio.to_thread(self.db.update_books, updates)
+            if lookups:
+                await asyncio.to_thread(self.db.record_lookups, self.SOURCE, lookups)
+
+        async def worker(session):
+            while True:
+                book_id = await queue.get()
+                try:
+                    data = await self._fetch(session, bucket, book_id)
+                except Exception as e:
+                    data = None
+                    print(f"{book_id}: {e!r}")
+                if data is None:
+                    result = "failed"
+                elif not data:
+                    result = "not_found"
+                else:
+                    result = "found"
+                    pending[book_id] = data
+                stats[result] += 1
+                results[book_id] = result
+                try:
+                    if len(results) >= self.batch_size:
+                        await flush()
+                except Exception as e:
+                    print(f"write failed: {e!r}")
+                finally:
+                    queue.task_done()
+
+        book_ids = list(book_ids)
+        due = await asyncio.to_thread(self.db.filter_lookups_due, book_ids, self.SOURCE)
+        stats["skipped"] = len(book_ids) - len(due)
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        async with aiohttp.ClientSession(
+            timeout=timeout, connector=connector
+        ) as session:
+            workers = [
+                asyncio.create_task(worker(session)) for _ in range(self.concurrency)
+            ]
+            for i, book_id in enumerate(due, 1):
+                await queue.put(book_id)
+                if i % 1000 == 0:
+                    print(f"{i} books queued: {stats}")
+            await queue.join()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        await flush()
+        return stats
+
+    async def _fetch(self, session, bucket, book_id):
+        """
+        Returns:
+            dict: metadata, an empty dict if Google Books answered that it has
+                  no such book, or None if the request failed or kept failing.
+        """
+        for attempt in range(self.max_retries + 1):
+            await bucket.acquire()
+            try:
+                async with session.get(self.url.format(book_id)) as response:
+                    if response.status == 200:
+                        json_data = await response.json(content_type=None)
+                        if not json_data.get("totalItems"):
+                            return {}
+                        return BookData._parse_google_books_response(json_data)
+                    if response.status not in self.RETRY_STATUSES:
+                        # 400/401/403 (e.g. quota exhausted) say nothing about the book
+                        print(f"{book_id}: HTTP {response.status}")
+                        return None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"{book_id}: {e!r}")
+
+            if attempt < self.max_retries:
+                # exponential backoff with jitter
+                await asyncio.sleep(min(60, 2**attempt) + random.random())
+        return None
+
+
+class EnrichmentQueue:
+    """
+    Background thread that enriches books queued by the web app, so that a
+    request renders what the database has and never waits for Google Books.
+
+    Every web worker process runs one, but only one of them fetches from
+    Google Books at a time: queued ids are passed on to a queue in MongoDB
+    (Database.request_enrichment), and the thread that holds the LOCK_NAME
+    lock takes them off that queue in small batches and fetches them with
+    GoogleBooksEnricher, which skips the books that recently could not be
+    found. So the rate limit holds for the whole server. If the holder stops,
+    another process takes over when the lock expires.
+
+    The results go through Database.update_books, which invalidates the book
+    cache of the holder. The other processes cache books without authors for
+    a short time only (Database.INCOMPLETE_BOOK_TTL), so they show the
+    filled-in metadata soon after.
+    """
+
+    LOCK_NAME = "enrichment"
+
+    def __init__(
+        self,
+        db=None,
+        batch_size: int = 20,
+        maxsize: int = 10000,
+        poll_interval: float = 5.0,
+        lock_duration: timedelta = timedelta(minutes=5),
+        **kwargs,
+    ):
+        """
+        Args:
+            db (Database, optional): database to write to. Defaults to the shared one.
+            batch_size (int): maximum number of books fetched together.
+            maxsize (int): maximum number of queued books. Further books are dropped.
+            poll_interval (float): seconds between two checks of the shared queue.
+            lock_duration (timedelta): time after which another process takes over
+                the enrichment from a holder that stopped.
+            **kwargs: arguments of GoogleBooksEnricher (concurrency, rate, ...).
+        """
+        kwargs.setdefault("concurrency", 2)
+        kwargs.setdefault("rate", 1.0)
+        self.enricher = GoogleBooksEnricher(db, batch_size=batch_size, **kwargs)
+        self.db = self.enricher.db
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lock_duration = lock_duration
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, book_id) -> bool:
+        """
+        Queue a book for enrichment.
+
+        Returns:
+            bool: True if the book was queued, False if it already was or the queue is full.
+        """
+        with self._lock:
+            if book_id in self.pending:
+                return False
+            try:
+                self.queue.put_nowait(book_id)
+            except queue.Full:
+                return False
+            self.pending.add(book_id)
+            return True
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name="enrichment", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout: float = None):
+        """Hand the queued books over to the shared queue and stop the thread"""
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _next_batch(self) -> list:
+        """Queued books, waiting up to poll_interval for the first one"""
+        try:
+            batch = [self.queue.get(timeout=self.poll_interval)]
+        except queue.Empty:
+            return []
+        while batch[-1] is not None:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _enrich_requested(self):
+        """Enrich the books of the shared queue while this process holds the lock"""
+        while self.db.acquire_lock(self.LOCK_NAME, self.owner, self.lock_duration):
+            book_ids = self.db.pop_enrichment_requests(self.batch_size)
+            if not book_ids:
+                return
+            stats = self.enricher.run(book_ids)
+            print(f"enriched {len(book_ids)} books: {stats}")
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            book_ids = [book_id for book_id in batch if book_id is not None]
+            try:
+                if book_ids:
+                    self.db.request_enrichment(book_ids)
+                if None not in batch:
+                    self._enrich_requested()
+            except Exception as e:
+                print(f"enrichment failed: {e!r}")
+            finally:
+                with self._lock:
+                    self.pending.difference_update(book_ids)
+            if None in batch:
+                return
@@ -0,0 +1,80 @@
+import threading
+from selenium.webdriver.common.by import By
+from modules.parser import has_element
+from modules.http_session import USER_AGENT, Throttle, create_session, map_unordered
+from modules.webdriver import BrowserPool
+
+
+class PageFetcher:
+    """
+    Fetch HTML pages over plain HTTP, falling back to a pool of browsers for
+    pages whose content is rendered with JavaScript.
+
+    A page is taken from the HTTP response when it contains the `ready`
+    selector given by the caller; otherwise it is loaded again in a browser,
+    which waits until the selector appears.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 4,
+        delay: float = 0.5,
+        browsers: int = 1,
+        timeout: float = 30,
+    ):
+        """
+        Args:
+            concurrency (int): number of pages fetched at the same time
+            delay (float): minimum interval between requests in seconds
+            browsers (int): size of the browser pool. 0 disables the fallback.
+            timeout (float): timeout of one page in seconds
+        """
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.throttle = Throttle(delay)
+        self.session = create_session(concurrency)
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.session.headers["Accept-Language"] = "ja"
+        self.browsers = BrowserPool(browsers, timeout=timeout) if browsers else None
+        self.stats = {"http": 0, "browser": 0}
+        self._lock = threading.Lock()
+
+    def close(self):
+        self.session.close()
+        if self.browsers is not None:
+            self.browsers.close()
+
+    def fetch(self, url: str, ready: str = None) -> str:
+        """
+        Args:
+            url (str): url
+            ready (str, optional): CSS selector of an element of the content
+
+        Returns:
+            str: HTML of the page
+        """
+        self.throttle.wait()
+        response = self.session.get(url, timeout=self.timeout)
+        if response.status_code == 200 and (
+            ready is None or has_element(response.text, ready)
+        ):
+            with self._lock:
+                self.stats["http"] += 1
+            return response.text
+        if self.browsers is None:
+            raise Exception(f"Error: {response.status_code} {url}")
+
+        self.throttle.wait()
+        with self._lock:
+            self.stats["browser"] += 1
+        locator = (By.CSS_SELECTOR, ready) if ready else None
+        return self.browsers.get_page_source(url, locator)
+
+    def fetch_many(self, urls, ready: str = None):
+        """
+        Fetch pages concurrently.
+
+        Yields:
+            tuple: (url, html) in the order the pages finish. html is None on failure.
+        """
+        return map_unordered(lambda url: self.fetch(url, ready), urls, self.concurrency)
@@ -0,0 +1,88 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    + "AppleWebKit/537.36 (KHTML, like Gecko) Chrome/88.0.4324.150 Safari/537.36"
+)
+
+
+class Throttle:
+    """Minimum interval between the starts of two requests, shared by threads"""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_time = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def create_session(pool_size: int, max_retries: int = 3) -> requests.Session:
+    """
+    requests.Session keeping up to pool_size connections per host alive,
+    retrying connection errors, 429 and 5xx with backoff.
+    """
+    retry = Retry(
+        total=max_retries,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def map_unordered(func, items, concurrency: int):
+    """
+    Run func on each item on a thread pool.
+
+    Args:
+        func (callable): function of one item
+        items (iterable): items. Read lazily, so it can be a generator.
+        concurrency (int): number of threads
+
+    Yields:
+        tuple: (item, result) in the order the calls finish.
+               result is None if the call raised an exception.
+    """
+    items = iter(items)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        running = {}
+
+        def submit():
+            # keep at most two calls per thread ahead of the consumer
+            while len(running) < concurrency * 2:
+                item = next(items, None)
+                if item is None:
+                    return
+                running[executor.submit(func, item)] = item
+
+        submit()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            results = []
+            for future in done:
+                item = running.pop(future)
+                try:
+                    results.append((item, future.result()))
+                except Exception as e:
+                    print(f"{item}: {e!r}")
+                    results.append((item, None))
+            # start the next calls before handing the results to the consumer
+            submit()
+            yield from results
@@ -0,0 +1,79 @@
+import hashlib
+import os
+from array import array
+
+
+class IdDictionary:
+    """
+    Persistent mapping between string ids (book ids, user ids) and dense
+    integer ids 0..N-1.
+
+    The file holds one string id per line and the line number is the integer
+    id. Ids are only appended, so an integer id keeps its meaning and
+    arrays encoded with an older version of the dictionary stay valid.
+    """
+
+    def __init__(self, path: str, load: bool = True):
+        """
+        :param path: Text file of the dictionary.
+        :param load: Read the existing file. If False, the dictionary starts
+                     empty and replaces the file when saved.
+        """
+        self.path = path
+        self._keys = []
+        self._index = {}
+        self._saved = None
+        if load and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._keys = f.read().splitlines()
+            self._index = {key: i for i, key in enumerate(self._keys)}
+            self._saved = len(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key) -> bool:
+        return key in self._index
+
+    def add(self, key: str) -> int:
+        """:return: The integer id of key, assigning the next one if it is new."""
+        i = self._index.get(key)
+        if i is None:
+            i = self._index[key] = len(self._keys)
+            self._keys.append(key)
+        return i
+
+    def get(self, key: str, default=None):
+        return self._index.get(key, default)
+
+    def key(self, i: int) -> str:
+        return self._keys[i]
+
+    def encode(self, keys) -> array:
+        """:return: The integer ids of keys as an array('i'). New keys are added."""
+        return array("i", map(self.add, keys))
+
+    def decode(self, ids) -> list:
+        keys = self._keys
+        return [keys[i] for i in ids]
+
+    def digest(self, n: int = None) -> str:
+        """:return: SHA-1 of the first n keys (all keys if n is None)."""
+        return hashlib.sha1("\n".join(self._keys[:n]).encode("utf-8")).hexdigest()
+
+    def extends(self, n: int, digest: str) -> bool:
+        """
+        :return: True if the first n keys are the ones of the dictionary that
+                 had n keys and the given digest, so that integer ids encoded
+                 with it mean the same here.
+        """
+        return len(self._keys) >= n and self.digest(n) == digest
+
+    def save(self):
+        """Write the dictionary if it was changed since it was loaded or saved"""
+        if self._saved == len(self._keys):
+            return
+        with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+            f.write("\n".join(self._keys))
+        os.replace(self.path + ".tmp", self.path)
+        self._saved = len(self._keys)
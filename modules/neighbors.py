@@ -0,0 +1,117 @@
+import os
+import numpy as np
+
+
+class NeighborTable:
+    """
+    Precomputed top-K neighbours of every vector of a model.
+
+    The table is two matrices stored next to the model file:
+    an int32 matrix of neighbour row indices and a float16 matrix of cosine
+    similarities, both sorted by similarity. They are loaded memory-mapped,
+    so a lookup is a single row read.
+    """
+
+    INDEX_SUFFIX = ".neighbors.idx.npy"
+    SCORE_SUFFIX = ".neighbors.score.npy"
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray):
+        self.indices = indices
+        self.scores = scores
+
+    @property
+    def k(self) -> int:
+        return self.indices.shape[1]
+
+    def __len__(self):
+        return self.indices.shape[0]
+
+    @classmethod
+    def paths(cls, prefix: str):
+        return prefix + cls.INDEX_SUFFIX, prefix + cls.SCORE_SUFFIX
+
+    @classmethod
+    def exists(cls, prefix: str) -> bool:
+        return all(os.path.exists(path) for path in cls.paths(prefix))
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        prefix: str,
+        k: int = 100,
+        memory_limit: int = 256 * 1024**2,
+    ) -> "NeighborTable":
+        """
+        Compute the table with chunked matrix multiplication and save it.
+
+        :param vectors: (N, D) matrix of vectors. Rows are normalized here.
+        :param prefix: Path prefix of the output files (usually the model file).
+        :param k: Number of neighbours kept per row.
+        :param memory_limit: Approximate number of bytes used for one chunk of scores.
+        :return: The saved table, loaded memory-mapped.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        vectors = vectors / norms
+
+        n = vectors.shape[0]
+        k = min(k, n - 1)
+        if k < 1:
+            raise ValueError("At least two vectors are needed to build the table")
+        chunk_size = max(1, memory_limit // (n * 4))
+
+        index_path, score_path = cls.paths(prefix)
+        tmp_index_path = index_path + ".tmp.npy"
+        tmp_score_path = score_path + ".tmp.npy"
+        indices = np.lib.format.open_memmap(
+            tmp_index_path, mode="w+", dtype=np.int32, shape=(n, k)
+        )
+        scores = np.lib.format.open_memmap(
+            tmp_score_path, mode="w+", dtype=np.float16, shape=(n, k)
+        )
+
+        for start in range(0, n, chunk_size):
+            end = min(start + chunk_size, n)
+            sims = vectors[start:end] @ vectors.T
+            # exclude the book itself
+            sims[np.arange(end - start), np.arange(start, end)] = -np.inf
+
+            top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            indices[start:end] = np.take_along_axis(top, order, axis=1)
+            scores[start:end] = np.take_along_axis(top_sims, order, axis=1)
+
+        indices.flush()
+        scores.flush()
+        del indices, scores
+        os.replace(tmp_index_path, index_path)
+        os.replace(tmp_score_path, score_path)
+        return cls.load(prefix)
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: str = "r") -> "NeighborTable":
+        index_path, score_path = cls.paths(prefix)
+        return cls(
+            np.load(index_path, mmap_mode=mmap_mode),
+            np.load(score_path, mmap_mode=mmap_mode),
+        )
+
+    @classmethod
+    def remove(cls, prefix: str):
+        for path in cls.paths(prefix):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def lookup(self, row: int, topn: int):
+        """
+        :return: (indices, similarities) of the topn nearest neighbours of row.
+        """
+        if topn > self.k:
+            raise ValueError(f"topn={topn} is larger than the table size k={self.k}")
+        return (
+            np.asarray(self.indices[row, :topn]),
+            np.asarray(self.scores[row, :topn], dtype=np.float32),
+        )
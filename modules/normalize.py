@@ -0,0 +1,44 @@
+import unicodedata
+from functools import lru_cache
+
+# カタカナ -> ひらがな (ァ..ヶ -> ぁ..ゖ)
+_KANA_FOLDING = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+
+@lru_cache(maxsize=None)
+def _is_ignored(char: str) -> bool:
+    """Punctuation, whitespace and control characters"""
+    return unicodedata.category(char)[0] in "PZC"
+
+
+def normalize_text(text) -> str:
+    """
+    Normalize a title, an author or a search keyword so that spelling
+    variants compare equal: NFKC (full-width/half-width), lower case,
+    katakana folded to hiragana, punctuation and whitespace removed.
+
+    Args:
+        text (str): text to normalize. None is treated as an empty string.
+
+    Returns:
+        str: normalized text
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower().translate(_KANA_FOLDING)
+    return "".join(char for char in text if not _is_ignored(char))
+
+
+def search_keys(title, authors=None) -> list:
+    """
+    Normalized keys of a book: its title and each of its authors.
+
+    Args:
+        title (str): title
+        authors (str, optional): comma-separated authors
+
+    Returns:
+        list: unique, non-empty keys
+    """
+    texts = [title] + (authors or "").split(",")
+    return list(dict.fromkeys(key for key in map(normalize_text, texts) if key))
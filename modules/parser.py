@@ -0,0 +1,202 @@
+"""
+Extraction of the few values the crawler needs from Booklog pages.
+
+The fastest installed backend is used: selectolax, then lxml, then
+BeautifulSoup with html.parser, which needs no extra package. Each backend
+implements the same extraction functions, so they return the same values.
+"""
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+
+def _class(name: str) -> str:
+    """XPath predicate matching one class of the class attribute"""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def _last_path_segment(href) -> str:
+    return href.split("/")[-1]
+
+
+def _tag_text(text: str) -> str:
+    # "タグ名(123)" -> "タグ名"
+    return text.split("(")[0]
+
+
+class SoupBackend:
+    """BeautifulSoup with html.parser. Always available."""
+
+    name = "html.parser"
+
+    @staticmethod
+    def _soup(html: str):
+        return BeautifulSoup(html, "html.parser")
+
+    def has_element(self, html: str, selector: str) -> bool:
+        return self._soup(html).select_one(selector) is not None
+
+    def profile_tags(self, html: str) -> list[str]:
+        tags = self._soup(html).select("ul.tagList > li > a")
+        return [_tag_text(tag.text) for tag in tags]
+
+    def profile_tag_users(self, html: str) -> list[str]:
+        users = []
+        areas = self._soup(html).select(
+            "div.autopagerize_page_element > div.tagListArea"
+        )
+        for area in areas:
+            a = area.select_one("div > a")
+            users.append(_last_path_segment(a.get("href")))
+        return users
+
+    def ranking_book_urls(self, html: str) -> list[str]:
+        books_a = self._soup(html).select(
+            "div.autopagerize_page_element > ul.ranking-list > li > div.desc > h3 > a"
+        )
+        return [book.get("href") for book in books_a]
+
+    def reviewer_ids(self, html: str) -> list[str]:
+        reviewers_a = self._soup(html).select(
+            "div#reviewLine > ul > li > div.summary > div.user-info-area > div > div.user-name-area > p > a"
+        )
+        return [_last_path_segment(user.get("href")) for user in reviewers_a]
+
+
+class SelectolaxBackend:
+    """selectolax (lexbor), a C parser with CSS selectors"""
+
+    name = "selectolax"
+
+    def has_element(self, html: str, selector: str) -> bool:
+        return HTMLParser(html).css_first(selector) is not None
+
+    def profile_tags(self, html: str) -> list[str]:
+        tags = HTMLParser(html).css("ul.tagList > li > a")
+        return [_tag_text(tag.text()) for tag in tags]
+
+    def profile_tag_users(self, html: str) -> list[str]:
+        users = []
+        areas = HTMLParser(html).css("div.autopagerize_page_element > div.tagListArea")
+        for area in areas:
+            a = next(a for a in area.css("a") if a.parent.tag == "div")
+            users.append(_last_path_segment(a.attributes.get("href")))
+        return users
+
+    def ranking_book_urls(self, html: str) -> list[str]:
+        books_a = HTMLParser(html).css(
+            "div.autopagerize_page_element > ul.ranking-list > li > div.desc > h3 > a"
+        )
+        return [book.attributes.get("href") for book in books_a]
+
+    def reviewer_ids(self, html: str) -> list[str]:
+        reviewers_a = HTMLParser(html).css(
+            "div#reviewLine > ul > li > div.summary > div.user-info-area > div > div.user-name-area > p > a"
+        )
+        return [_last_path_segment(user.attributes.get("href")) for user in reviewers_a]
+
+
+class LxmlBackend:
+    """lxml with XPath (no cssselect needed)"""
+
+    name = "lxml"
+
+    # XPath of the selectors passed to has_element
+    READY_XPATHS = {
+        "ul.tagList": f"//ul[{_class('tagList')}]",
+        "div.autopagerize_page_element": f"//div[{_class('autopagerize_page_element')}]",
+        "#reviewLine": "//*[@id='reviewLine']",
+    }
+
+    @staticmethod
+    def _tree(html: str):
+        return lxml.html.fromstring(html)
+
+    def has_element(self, html: str, selector: str) -> bool:
+        return bool(self._tree(html).xpath(self.READY_XPATHS[selector]))
+
+    def profile_tags(self, html: str) -> list[str]:
+        tags = self._tree(html).xpath(f"//ul[{_class('tagList')}]/li/a")
+        return [_tag_text(tag.text_content()) for tag in tags]
+
+    def profile_tag_users(self, html: str) -> list[str]:
+        areas = self._tree(html).xpath(
+            f"//div[{_class('autopagerize_page_element')}]/div[{_class('tagListArea')}]"
+        )
+        return [
+            _last_path_segment(area.xpath(".//a[parent::div][1]/@href")[0])
+            for area in areas
+        ]
+
+    def ranking_book_urls(self, html: str) -> list[str]:
+        return self._tree(html).xpath(
+            f"//div[{_class('autopagerize_page_element')}]/ul[{_class('ranking-list')}]"
+            f"/li/div[{_class('desc')}]/h3/a/@href"
+        )
+
+    def reviewer_ids(self, html: str) -> list[str]:
+        hrefs = self._tree(html).xpath(
+            f"//div[@id='reviewLine']/ul/li/div[{_class('summary')}]"
+            f"/div[{_class('user-info-area')}]/div/div[{_class('user-name-area')}]/p/a/@href"
+        )
+        return [_last_path_segment(href) for href in hrefs]
+
+
+BACKENDS = {"html.parser": SoupBackend}
+if lxml is not None:
+    BACKENDS["lxml"] = LxmlBackend
+if HTMLParser is not None:
+    BACKENDS["selectolax"] = SelectolaxBackend
+
+
+def get_backend(name: str = None):
+    """
+    Args:
+        name (str, optional): "selectolax", "lxml" or "html.parser".
+            Defaults to the fastest installed backend.
+    """
+    if name is None:
+        for name in ("selectolax", "lxml", "html.parser"):
+            if name in BACKENDS:
+                break
+    return BACKENDS[name]()
+
+
+backend = get_backend()
+
+
+def has_element(html: str, selector: str) -> bool:
+    """
+    Whether the page has an element matching selector, one of
+    "ul.tagList", "div.autopagerize_page_element" or "#reviewLine".
+    """
+    return backend.has_element(html, selector)
+
+
+def extract_profile_tags(html: str) -> list[str]:
+    """Tags of https://booklog.jp/profiletags"""
+    return backend.profile_tags(html)
+
+
+def extract_profile_tag_users(html: str) -> list[str]:
+    """User ids of a page of https://booklog.jp/profiletag/{tag}"""
+    return backend.profile_tag_users(html)
+
+
+def extract_ranking_book_urls(html: str) -> list[str]:
+    """Book urls of a page of https://booklog.jp/ranking/annual/{year}/book"""
+    return backend.ranking_book_urls(html)
+
+
+def extract_reviewer_ids(html: str) -> list[str]:
+    """User ids of the reviewers on a page of a book"""
+    return backend.reviewer_ids(html)
@@ -0,0 +1,261 @@
+import logging
+import queue
+import threading
+import time
+
+# marks the end of the input of a worker
+_DONE = object()
+
+
+class Stage:
+    """A step of a Pipeline, run by its own worker threads"""
+
+    def __init__(
+        self,
+        name: str,
+        func,
+        workers: int = 1,
+        queue_size: int = 100,
+        batch_size: int = 1,
+        batch_timeout: float = 1.0,
+        on_error=None,
+    ):
+        """
+        Args:
+            name (str): name in the logs
+            func (callable): takes an item, or a list of items if batch_size > 1,
+                and returns an iterable of items for the next stage (or None)
+            workers (int): number of threads
+            queue_size (int): capacity of the queue in front of the stage
+            batch_size (int): maximum number of items given to func at once
+            batch_timeout (float): seconds to wait for a batch to fill up
+            on_error (callable, optional): called with the item (or list of items)
+                and the exception when func raises. The error is counted and
+                logged either way.
+        """
+        self.name = name
+        self.func = func
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.on_error = on_error
+        self.inbox = queue.Queue(maxsize=queue_size)
+        self.threads = []
+        self.processed = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def _next_batch(self):
+        """
+        Returns:
+            tuple: (items, done). done is True when the end of the input was reached.
+        """
+        item = self.inbox.get()
+        if item is _DONE:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.batch_timeout
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                item = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _DONE:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def work(self, output, logger):
+        """Worker loop: process items until the end of the input"""
+        done = False
+        while not done:
+            batch, done = self._next_batch()
+            if not batch:
+                continue
+            items = batch if self.batch_size > 1 else batch[0]
+            try:
+                results = self.func(items)
+            except Exception as e:
+                results = None
+                with self._lock:
+                    self.errors += 1
+                logger.error(f"{self.name}: {e!r}")
+                if self.on_error is not None:
+                    try:
+                        self.on_error(items, e)
+                    except Exception as e:
+                        logger.error(f"{self.name}: on_error failed: {e!r}")
+            with self._lock:
+                self.processed += len(batch)
+            if output is not None:
+                for result in results or ():
+                    output.put(result)
+
+
+class Pipeline:
+    """
+    Stages connected by bounded queues, each stage with its own workers.
+
+    Items from the source go through the stages in order. A full queue
+    blocks the stage in front of it, so a slow stage slows down the ones
+    before it instead of piling up items (backpressure). On Ctrl-C the
+    source is no longer read, and the items already in the queues are
+    drained through the stages before run returns. Throughput, errors and
+    queue depth of each stage are logged every report_interval seconds.
+    """
+
+    def __init__(self, name: str = "pipeline", logger=None, report_interval=30):
+        self.name = name
+        self.logger = logger or logging.getLogger(name)
+        self.report_interval = report_interval
+        self.stages = []
+        self.produced = 0
+
+    def add_stage(self, name: str, func, **kwargs) -> "Pipeline":
+        """Append a stage. kwargs are passed to Stage."""
+        self.stages.append(Stage(name, func, **kwargs))
+        return self
+
+    def metrics(self) -> dict:
+        return {
+            stage.name: {
+                "processed": stage.processed,
+                "errors": stage.errors,
+                "queue": stage.inbox.qsize(),
+            }
+            for stage in self.stages
+        }
+
+    def _report(self, stop: threading.Event):
+        last = {stage.name: 0 for stage in self.stages}
+        last_time = time.monotonic()
+        while not stop.wait(self.report_interval):
+            now = time.monotonic()
+            lines = []
+            for stage in self.stages:
+                rate = (stage.processed - last[stage.name]) / (now - last_time)
+                last[stage.name] = stage.processed
+                lines.append(
+                    f"{stage.name}: {stage.processed} done ({rate:.1f}/s), "
+                    f"{stage.errors} errors, "
+                    f"queue {stage.inbox.qsize()}/{stage.inbox.maxsize}"
+                )
+            last_time = now
+            self.logger.info(f"[{self.name}] " + " | ".join(lines))
+
+    def run(self, source) -> dict:
+        """
+        Feed the items of source to the first stage and wait until every
+        stage has processed them.
+
+        Returns:
+            dict: metrics of each stage
+        """
+        for i, stage in enumerate(self.stages):
+            output = self.stages[i + 1].inbox if i + 1 < len(self.stages) else None
+            stage.threads = [
+                threading.Thread(
+                    target=stage.work,
+                    args=(output, self.logger),
+                    name=f"{stage.name}-{n}",
+                    daemon=True,
+                )
+                for n in range(stage.workers)
+            ]
+            for thread in stage.threads:
+                thread.start()
+
+        stop_report = threading.Event()
+        reporter = threading.Thread(
+            target=self._report, args=(stop_report,), daemon=True
+        )
+        reporter.start()
+
+        start = time.monotonic()
+        try:
+            for item in source:
+                self.stages[0].inbox.put(item)
+                self.produced += 1
+        except KeyboardInterrupt:
+            self.logger.warning(
+                f"[{self.name}] interrupted, draining the queued items "
+                "(press Ctrl-C again to abort)"
+            )
+        finally:
+            close = getattr(source, "close", None)
+            if close is not None:
+                close()
+
+        # stages are finished in order, each after the one in front of it
+        for stage in self.stages:
+            for _ in stage.threads:
+                stage.inbox.put(_DONE)
+            for thread in stage.threads:
+                thread.join()
+        stop_report.set()
+
+        metrics = self.metrics()
+        self.logger.info(
+            f"[{self.name}] {self.produced} items in {time.monotonic() - start:.1f} s: "
+            f"{metrics}"
+        )
+        return metrics
+
+
+def shelf_pipeline(
+    scraper, db, checkpoint, fetch_workers=None, batch_size=50, logger=None
+) -> Pipeline:
+    """
+    Pipeline saving the shelves of discovered users:
+    shelf fetching (fetch_workers threads, by default as many as the
+    connections of the scraper's BookshelfLoader) -> batched database writes.
+
+    The source yields the user ids returned by checkpoint.track. Users are
+    completed in the checkpoint once their shelf is saved, or as failed.
+    """
+    logger = logger or logging.getLogger("crawl")
+    fetch_workers = fetch_workers or scraper.bookshelf.concurrency
+
+    def fetch(user_id):
+        return [(user_id, scraper.load_books(user_id))]
+
+    def fetch_failed(user_id, e):
+        # counted in the errors of the fetch stage; retried by a later run
+        logger.error(f"Failed to load books of [{user_id}]: {e!r}")
+        checkpoint.complete(user_id, ok=False)
+
+    def write(batch):
+        # ユーザーは本棚の保存後に登録される
+        shelves = {
+            user_id: [(book["BOOK_ID"], book["TITLE"]) for book in books]
+            for user_id, books in batch
+        }
+        result = db.insert_user_shelves(shelves)
+        for user_id, _ in batch:
+            checkpoint.complete(user_id)
+        logger.info(f"Saved {len(shelves)} users: {result}")
+
+    def write_failed(batch, e):
+        for user_id, _ in batch:
+            checkpoint.complete(user_id, ok=False)
+
+    pipeline = Pipeline("crawl", logger=logger)
+    pipeline.add_stage(
+        "fetch",
+        fetch,
+        workers=fetch_workers,
+        queue_size=fetch_workers * 4,
+        on_error=fetch_failed,
+    )
+    pipeline.add_stage(
+        "write",
+        write,
+        workers=1,
+        queue_size=batch_size * 4,
+        batch_size=batch_size,
+        on_error=write_failed,
+    )
+    return pipeline
@@ -1,11 +1,12 @@
-import requests
-from modules.webdriver import WebDriver
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
-from selenium.webdriver.common.by import By
-from bs4 import BeautifulSoup
-from time import sleep
+from modules.bookshelf import BookshelfLoader
+from modules.fetcher import PageFetcher
+from modules.http_session import map_unordered
+from modules.parser import (
+    extract_profile_tag_users,
+    extract_profile_tags,
+    extract_ranking_book_urls,
+    extract_reviewer_ids,
+)
 from tqdm.auto import tqdm
 
 # from datetime import datetime, timedelta
@@ -13,7 +14,17 @@ from tqdm.auto import tqdm
 
 
 class Scraping:
-    def __init__(self, category=0, count=99999, status=0, rank=0):
+    def __init__(
+        self,
+        category=0,
+        count=99999,
+        status=0,
+        rank=0,
+        concurrency=4,
+        delay=0.5,
+        browsers=1,
+        base_url="https://booklog.jp",
+    ):
         """
         Scrapingクラスのコンストラクタ
 
@@ -22,6 +33,10 @@ class Scraping:
             count (int): 取得する書籍数
             status (int): 読書状況
             rank (int): ランキング
+            concurrency (int): 本棚APIとページへの同時リクエスト数
+            delay (float): 本棚APIとページへのリクエスト間隔 (秒)
+            browsers (int): JavaScriptが必要なページ用のブラウザ数 (0で使わない)
+            base_url (str): BooklogのURL (ローカルのテスト用サーバーなど)
 
         Returns:
             None
@@ -31,10 +46,36 @@ class Scraping:
         self.count = count
         self.status = status
         self.rank = rank
-        self.webdriver = WebDriver()
-        self.webdriver.clear()
-        self.driver = self.webdriver.driver()
-        self.wait = WebDriverWait(self.driver, self.wait_time)
+        self.base_url = base_url
+        self.bookshelf = BookshelfLoader(
+            concurrency=concurrency,
+            delay=delay,
+            category=category,
+            count=count,
+            status=status,
+            rank=rank,
+        )
+        # ページは通常のHTTPで取得し、取得できない場合だけブラウザを起動する
+        self.fetcher = PageFetcher(
+            concurrency=concurrency, delay=delay, browsers=browsers
+        )
+
+    def close(self):
+        self.fetcher.close()
+        self.bookshelf.close()
+
+    def _fetch_pages(self, urls: list[str], ready: str = None) -> list[str]:
+        """
+        Fetch pages concurrently.
+
+        Returns:
+            list: HTML of the pages, in the order of urls
+        """
+        pages = dict(self.fetcher.fetch_many(urls, ready))
+        for url in urls:
+            if pages[url] is None:
+                raise Exception(f"Failed to fetch: {url}")
+        return [pages[url] for url in urls]
 
     def get_popular_profile_tags(self):
         """
@@ -46,15 +87,10 @@ class Scraping:
         Returns:
             list: プロフィールタグのリスト
         """
-        url = "https://booklog.jp/profiletags"
-        driver = self.driver
-        self.webdriver.get(url)
-        sleep(self.wait_time)
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        tags = soup.select("ul.tagList > li > a")
+        url = f"{self.base_url}/profiletags"
+        html = self.fetcher.fetch(url, "ul.tagList")
         # tagのテキストを取得。()内の文字列を削除
-        tags = [tag.text.split("(")[0] for tag in tags]
-        return tags
+        return extract_profile_tags(html)
 
     def get_users_from_profile_tag(self, tag: str, page: int = 1):
         """
@@ -80,6 +116,7 @@ class Scraping:
     def get_book_urls_from_ranking(self, year: int, page: int = 6) -> list[str]:
         """
         Get Booklog users from popular books.
+        The pages are fetched concurrently.
 
         Args:
             year (int): year
@@ -93,95 +130,68 @@ class Scraping:
         elif page < 1:
             page = 1
 
+        urls = [
+            f"{self.base_url}/ranking/annual/{str(year)}/book?page={p}"
+            for p in range(1, page + 1)
+        ]
         book_urls = []
-        for p in range(1, page + 1):
-            url = f"https://booklog.jp/ranking/annual/{str(year)}/book?page={p}"
-            driver = self.driver
-            self.webdriver.get(url)
-            sleep(self.wait_time)
-            soup = BeautifulSoup(driver.page_source, "html.parser")
-            books_a = soup.select(
-                "div.autopagerize_page_element > ul.ranking-list > li > div.desc > h3 > a"
-            )
-            book_urls.extend([book.get("href") for book in books_a])
+        for html in self._fetch_pages(urls, "div.autopagerize_page_element"):
+            book_urls.extend(extract_ranking_book_urls(html))
         return book_urls
 
-    def get_users_from_book_url(self, book_url: str, page: int = 1) -> list[str]:
+    def _review_urls(self, book_url: str, page: int) -> list[str]:
         if page > 10:
             page = 10
         elif page < 1:
             page = 1
+        return [f"{self.base_url}{book_url}?page={p}" for p in range(1, page + 1)]
 
+    def get_users_from_book_url(self, book_url: str, page: int = 1) -> list[str]:
         user_id_list = []
-        for p in range(1, page + 1):
-            url = f"https://booklog.jp{book_url}?page={p}"
-            driver = self.driver
-            self.webdriver.get(url)
-
-            try:
-                self.wait.until(EC.presence_of_element_located((By.ID, "reviewLine")))
-            except TimeoutException:
-                raise TimeoutException(f"Timeout: {url}")
-
-            soup = BeautifulSoup(driver.page_source, "html.parser")
-            reviewers_a = soup.select(
-                "div#reviewLine > ul > li > div.summary > div.user-info-area > div > div.user-name-area > p > a"
-            )
-            user_id_list.extend(
-                [user.get("href").split("/")[-1] for user in reviewers_a]  # type: ignore
-            )
+        for html in self._fetch_pages(self._review_urls(book_url, page), "#reviewLine"):
+            user_id_list.extend(extract_reviewer_ids(html))
         return user_id_list
 
+    def get_users_from_book_urls(self, book_urls, page: int = 1):
+        """
+        Get reviewers of several books concurrently.
+        The review pages of one book are fetched one after another.
+
+        Args:
+            book_urls (iterable): book urls from get_book_urls_from_ranking
+            page (int): number of review pages of each book
+
+        Yields:
+            tuple: (book_url, list of users) in the order the books finish,
+                   or (book_url, None) on failure.
+        """
+
+        def get_users(book_url):
+            # 並列化は本の単位だけにして、同時リクエスト数をconcurrencyまでに抑える
+            user_id_list = []
+            for url in self._review_urls(book_url, page):
+                html = self.fetcher.fetch(url, "#reviewLine")
+                user_id_list.extend(extract_reviewer_ids(html))
+            return user_id_list
+
+        return map_unordered(get_users, book_urls, self.fetcher.concurrency)
+
     def _get_users(self, tag: str, page: int):
-        url = f"https://booklog.jp/profiletag/{tag}?page={page}"
-        driver = self.driver
-        self.webdriver.get(url)
-
-        try:
-            self.wait.until(
-                EC.presence_of_element_located(
-                    (By.CLASS_NAME, "autopagerize_page_element")
-                )
-            )
-        except TimeoutException:
-            raise TimeoutException(f"Timeout: {url}")
-
-        soup = BeautifulSoup(driver.page_source, "html.parser")
-        users_div = soup.select("div.autopagerize_page_element > div.tagListArea")
-        users = []
-        for user in users_div:
-            a = user.select_one("div > a")
-            user = a.get("href").split("/")[-1]  # type: ignore
-            users.append(user)
-        return users
+        url = f"{self.base_url}/profiletag/{tag}?page={page}"
+        html = self.fetcher.fetch(url, "div.autopagerize_page_element")
+        return extract_profile_tag_users(html)
 
     def load_books(self, user_id):
         """
         Get information of books from Booklog.
 
         Args:
-            None
+            user_id (str): user id
 
         Returns:
             list: list of information of book.
         """
-        url = f"https://api.booklog.jp/json/{user_id}"
-        params = {
-            "category": self.category,
-            "status": self.status,
-            "rank": self.rank,
-            "count": self.count,
-        }
-        response = requests.get(url, params=params)
-        if response.status_code != 200:
-            return []
-
-        try:
-            data = response.json()
-        except Exception as e:
-            raise Exception(f"Error: {e} \n Response: {response.text}")
-
-        return self.format2list(data)
+        return self.bookshelf.load(user_id)
 
     def format2list(self, data: dict) -> list[dict]:
         """
@@ -193,13 +203,4 @@ class Scraping:
         Returns:
             list[dict]: list of dictionary
         """
-        books = data.get("books", [])
-        new_books = []
-        for book in books:
-            book = {
-                "BOOK_ID": book["url"].split("/")[-1],
-                "TITLE": book["title"]
-                # "CATALOG": book["catalog"],
-            }
-            new_books.append(book)
-        return new_books
+        return [BookshelfLoader.format_book(book) for book in data.get("books", [])]
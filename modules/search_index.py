@@ -0,0 +1,236 @@
+import os
+import shutil
+import time
+from collections import defaultdict
+import numpy as np
+from modules.normalize import normalize_text
+
+
+class SearchIndex:
+    """
+    Read-only inverted index over book titles and authors.
+
+    Titles, authors and keywords are normalized with normalize_text, so
+    width, kana and punctuation variants match each other. Texts are split
+    into character bi-grams (and single characters for
+    one-letter keywords), which works for Japanese without a word
+    segmenter. A keyword matches a book when its title or authors contain
+    the keyword, and a search returns books matching any of the keywords,
+    like the $regex query it replaces, ranked by their reader count.
+
+    The index is a snapshot built by _search_index.py and saved as .npy
+    files: the sorted grams, the offsets of their postings, the postings
+    (sorted int32 book positions), the book ids and the normalized texts.
+    Books are numbered by reader count, so sorting positions ranks them.
+    The files are loaded memory-mapped, so the web workers share one copy
+    through the page cache. Books written after the snapshot are found once
+    the index is rebuilt; the workers load the new snapshot with reload.
+    """
+
+    INDEX_DIR = "search_index"
+    CURRENT_FILE = "current"
+    # number of snapshots kept for workers still using them
+    KEEP_VERSIONS = 2
+    # seconds between two checks of CURRENT_FILE by reload
+    RELOAD_INTERVAL = 60
+    FILES = {
+        "grams": "grams.npy",
+        "offsets": "offsets.npy",
+        "postings": "postings.npy",
+        "book_ids": "book_ids.npy",
+        "text_offsets": "text_offsets.npy",
+        "texts": "texts.npy",
+    }
+
+    def __init__(
+        self, grams, offsets, postings, book_ids, text_offsets, texts, version=None
+    ):
+        """
+        :param grams: (G,) sorted unicode array of the grams.
+        :param offsets: (G + 1,) start of the postings of each gram.
+        :param postings: Sorted book positions of each gram, concatenated.
+        :param book_ids: (N,) book ids, most read first.
+        :param text_offsets: (N + 1,) start of the text of each book in texts.
+        :param texts: UTF-8 bytes of the normalized "title\\nauthors" of the books.
+        :param version: Name of the snapshot directory.
+        """
+        self.grams = grams
+        self.offsets = offsets
+        self.postings = postings
+        self.book_ids = book_ids
+        self.text_offsets = text_offsets
+        self.texts = texts
+        self.version = version
+        self.checked_at = time.monotonic()
+
+    @staticmethod
+    def _grams(text: str) -> set:
+        grams = set(text)
+        grams.update(text[i : i + 2] for i in range(len(text) - 1))
+        return grams
+
+    def __len__(self):
+        return len(self.book_ids)
+
+    @classmethod
+    def build(cls, books) -> "SearchIndex":
+        """
+        :param books: Iterable of book documents with _id, title, authors and count.
+        """
+        books = sorted(books, key=lambda book: -(book.get("count") or 0))
+        postings = defaultdict(list)
+        texts = []
+        for position, book in enumerate(books):
+            # normalize_text removes newlines, so a keyword can't span both texts
+            text = (
+                normalize_text(book.get("title"))
+                + "\n"
+                + normalize_text(book.get("authors"))
+            )
+            texts.append(text.encode("utf-8"))
+            for gram in cls._grams(text):
+                if "\n" not in gram:
+                    postings[gram].append(position)
+
+        grams = sorted(postings)
+        offsets = np.zeros(len(grams) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[gram]) for gram in grams])
+        text_offsets = np.zeros(len(texts) + 1, dtype=np.int64)
+        text_offsets[1:] = np.cumsum([len(text) for text in texts])
+        return cls(
+            np.array(grams, dtype="U2"),
+            offsets,
+            np.fromiter(
+                (p for gram in grams for p in postings[gram]),
+                dtype=np.int32,
+                count=offsets[-1],
+            ),
+            np.array([book["_id"] for book in books], dtype=str),
+            text_offsets,
+            np.frombuffer(b"".join(texts), dtype=np.uint8),
+        )
+
+    def _posting(self, gram: str) -> np.ndarray:
+        i = np.searchsorted(self.grams, gram)
+        if i == len(self.grams) or self.grams[i] != gram:
+            return self.postings[:0]
+        return self.postings[self.offsets[i] : self.offsets[i + 1]]
+
+    def _text(self, position: int) -> str:
+        start, end = self.text_offsets[position], self.text_offsets[position + 1]
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+    def _match(self, keyword: str, limit: int = None) -> list:
+        """:return: The first limit positions (the most read books) matching keyword."""
+        grams = {keyword[i : i + 2] for i in range(len(keyword) - 1)} or {keyword}
+        postings = sorted(map(self._posting, grams), key=len)
+        candidates = np.asarray(postings[0])
+        for posting in postings[1:]:
+            if not len(candidates):
+                break
+            candidates = np.intersect1d(candidates, posting, assume_unique=True)
+        if len(keyword) <= 2:
+            # the keyword is a gram itself
+            return candidates[:limit].tolist()
+        # bi-grams can match out of order, so check the whole keyword
+        matches = []
+        for position in candidates.tolist():
+            if keyword in self._text(position):
+                matches.append(position)
+                if len(matches) == limit:
+                    break
+        return matches
+
+    def search(self, keywords: str, limit: int = None) -> list:
+        """
+        :param keywords: Space-separated keywords.
+        :param limit: Maximum number of book_ids returned.
+        :return: book_ids matching any keyword, most read first.
+        """
+        positions = set()
+        for keyword in map(normalize_text, keywords.split()):
+            if keyword:
+                positions.update(self._match(keyword, limit))
+        return [str(self.book_ids[p]) for p in sorted(positions)[:limit]]
+
+    def save(self, directory: str = None) -> str:
+        """
+        Save the index as a new snapshot and make it the current one.
+
+        :param directory: Directory of the snapshots. Defaults to INDEX_DIR.
+        :return: Name of the snapshot.
+        """
+        directory = directory or self.INDEX_DIR
+        name = version = time.strftime("%Y%m%d-%H%M%S")
+        n = 0
+        while os.path.exists(os.path.join(directory, version)):
+            n += 1
+            version = f"{name}-{n}"
+        os.makedirs(os.path.join(directory, version))
+        for name, file in self.FILES.items():
+            np.save(os.path.join(directory, version, file), getattr(self, name))
+        self.version = version
+
+        pointer = os.path.join(directory, self.CURRENT_FILE)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+
+        versions = sorted(
+            (
+                os.path.join(directory, name)
+                for name in os.listdir(directory)
+                if os.path.isdir(os.path.join(directory, name)) and name != version
+            ),
+            key=os.path.getmtime,
+        )
+        for path in versions[: max(0, len(versions) + 1 - self.KEEP_VERSIONS)]:
+            # files memory-mapped by a running process cannot be deleted on Windows
+            shutil.rmtree(path, ignore_errors=True)
+        return version
+
+    @classmethod
+    def current_version(cls, directory: str = None):
+        """:return: Name of the current snapshot, or None if there is none."""
+        pointer = os.path.join(directory or cls.INDEX_DIR, cls.CURRENT_FILE)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer, "r") as f:
+            return f.read().strip()
+
+    @classmethod
+    def exists(cls, directory: str = None) -> bool:
+        return cls.current_version(directory) is not None
+
+    @classmethod
+    def load(cls, directory: str = None, mmap_mode: str = "r") -> "SearchIndex":
+        """Load the current snapshot memory-mapped"""
+        directory = directory or cls.INDEX_DIR
+        version = cls.current_version(directory)
+        if version is None:
+            raise FileNotFoundError(f"No search index in {directory}")
+        arrays = {
+            name: np.load(os.path.join(directory, version, file), mmap_mode=mmap_mode)
+            for name, file in cls.FILES.items()
+        }
+        return cls(**arrays, version=version)
+
+    @classmethod
+    def reload(cls, index=None, directory: str = None):
+        """
+        Load the current snapshot if it is not index. The snapshot is checked
+        at most every RELOAD_INTERVAL seconds.
+
+        :param index: The loaded SearchIndex, or None.
+        :return: index, or the newly loaded SearchIndex (None if there is no snapshot).
+        """
+        now = time.monotonic()
+        if index is not None and now - index.checked_at < cls.RELOAD_INTERVAL:
+            return index
+        version = cls.current_version(directory)
+        if version is None:
+            return index
+        if index is not None and index.version == version:
+            index.checked_at = now
+            return index
+        return cls.load(directory)
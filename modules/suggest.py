@@ -0,0 +1,95 @@
+import os
+import pickle
+from bisect import bisect_left
+from heapq import nlargest
+from modules.normalize import normalize_text
+
+
+class PrefixIndex:
+    """
+    Prefix index over normalized titles and authors for search-as-you-type.
+
+    Keys are kept in a sorted list and a prefix is looked up with bisect.
+    Because one- and two-character prefixes match a large part of the books,
+    their results are computed when the index is built.
+    """
+
+    INDEX_FILE = "suggest_index.pkl"
+    PRECOMPUTED_PREFIX_LENGTH = 2
+
+    def __init__(self, limit: int = 10, max_scan: int = 20000):
+        """
+        :param limit: Number of suggestions precomputed for short prefixes.
+        :param max_scan: Maximum number of keys ranked for one prefix.
+        """
+        self.limit = limit
+        self.max_scan = max_scan
+        self.keys = []
+        self.key_books = []
+        self.books = {}
+        self.top = {}
+
+    def __len__(self):
+        return len(self.books)
+
+    @classmethod
+    def build(cls, books, limit: int = 10) -> "PrefixIndex":
+        """
+        :param books: Iterable of book documents with _id, title, authors and count.
+        """
+        index = cls(limit=limit)
+        entries = []
+        for book in books:
+            book_id, count = book["_id"], book.get("count") or 0
+            index.books[book_id] = (book.get("title"), book.get("authors"), count)
+            texts = [book.get("title")] + (book.get("authors") or "").split(",")
+            for key in {normalize_text(text) for text in texts} - {""}:
+                entries.append((key, book_id))
+        entries.sort()
+        index.keys = [key for key, _ in entries]
+        index.key_books = [book_id for _, book_id in entries]
+
+        # most read books first, so the first books seen for a prefix are its top
+        for key, book_id in sorted(entries, key=lambda e: -index.books[e[1]][2]):
+            for n in range(1, min(len(key), cls.PRECOMPUTED_PREFIX_LENGTH) + 1):
+                top = index.top.setdefault(key[:n], [])
+                if len(top) < limit and book_id not in top:
+                    top.append(book_id)
+        return index
+
+    def search(self, query: str, limit: int = 10) -> list:
+        """
+        :return: Suggestions as dicts of book_id, title and authors, most read first.
+        """
+        prefix = normalize_text(query)
+        if not prefix:
+            return []
+
+        if len(prefix) <= self.PRECOMPUTED_PREFIX_LENGTH and limit <= self.limit:
+            book_ids = self.top.get(prefix, [])[:limit]
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + "\U0010ffff", start)
+            end = min(end, start + self.max_scan)
+            candidates = set(self.key_books[start:end])
+            book_ids = nlargest(limit, candidates, key=lambda b: self.books[b][2])
+
+        return [
+            {
+                "book_id": book_id,
+                "title": self.books[book_id][0],
+                "authors": self.books[book_id][1],
+            }
+            for book_id in book_ids
+        ]
+
+    def save(self, path: str = None):
+        path = path or self.INDEX_FILE
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str = None) -> "PrefixIndex":
+        with open(path or cls.INDEX_FILE, "rb") as f:
+            return pickle.load(f)
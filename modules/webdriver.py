@@ -1,4 +1,9 @@
 from selenium import webdriver
+from selenium.webdriver.support.wait import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+import queue
+import threading
 import time
 
 
@@ -66,3 +71,82 @@ class WebDriver:
             time.sleep(sleep_time)
         else:
             raise Exception("driver is None")
+
+
+class BrowserPool:
+    """
+    Pool of reusable WebDriver instances, shared by threads.
+    Browsers are started when they are first needed.
+    After close, waiting and later calls raise an exception.
+    """
+
+    def __init__(self, size: int = 1, timeout: float = 30):
+        """
+        Args:
+            size (int): maximum number of browsers
+            timeout (float): seconds to wait for the content of a page
+        """
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.Queue()
+        self._browsers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _acquire(self) -> WebDriver:
+        with self._lock:
+            if self._closed:
+                raise Exception("BrowserPool is closed")
+        try:
+            browser = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                if len(self._browsers) < self.size:
+                    browser = WebDriver()
+                    self._browsers.append(browser)
+                    return browser
+            browser = self._idle.get()
+        if browser is None:
+            # closed: pass the sentinel on to the next waiting thread
+            self._idle.put(None)
+            raise Exception("BrowserPool is closed")
+        return browser
+
+    def get_page_source(self, url: str, locator=None) -> str:
+        """
+        Load a page in one of the browsers.
+
+        Args:
+            url (str): url
+            locator (tuple, optional): (By, value) of an element to wait for
+
+        Returns:
+            str: page source
+        """
+        browser = self._acquire()
+        try:
+            driver = browser.driver()
+            driver.get(url)
+            if locator is not None:
+                WebDriverWait(driver, self.timeout).until(
+                    EC.presence_of_element_located(locator)
+                )
+            return driver.page_source
+        except TimeoutException:
+            raise TimeoutException(f"Timeout: {url}")
+        finally:
+            with self._lock:
+                closed = self._closed
+            if closed:
+                browser.clear()
+            else:
+                self._idle.put(browser)
+
+    def close(self):
+        """quit all browsers and wake up the threads waiting for one"""
+        with self._lock:
+            self._closed = True
+            for browser in self._browsers:
+                browser.clear()
+            self._browsers = []
+        self._idle.put(None)
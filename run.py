@@ -1,25 +1,46 @@
-from flask import Flask, render_template, request, Response
+from flask import Flask, render_template, request, Response, jsonify
 from typing import Union
 from modules.book2vec import Model
 from modules.database import Database
-from modules.book_data import BookData
+from modules.enrichment import EnrichmentQueue
+from modules.search_index import SearchIndex
+from modules.suggest import PrefixIndex
 from datetime import datetime
+import os
 
 
 app = Flask(__name__)
 model = Model()
-model.load_model()
+model.load_model(inference=True)
+db = Database()
+# 検索インデックスは _search_index.py で定期的に作り直し、各ワーカーが読み込み直す
+Database.search_index = SearchIndex.reload()
+suggest_index = PrefixIndex.load() if os.path.exists(PrefixIndex.INDEX_FILE) else None
+# 書誌情報が足りない本は、リクエストを待たせずにバックグラウンドで取得する
+# (Google Books への問い合わせは、すべてのワーカーのうち1つのプロセスだけが行う)
+enrichment_queue = EnrichmentQueue(db)
+enrichment_queue.start()
+
+
+@app.before_request
+def reload_search_index():
+    Database.search_index = SearchIndex.reload(Database.search_index)
+
+
+def get_book_info(book_id, book) -> dict:
+    book_info = dict(book or {})
+    if not book_info.get("authors"):
+        enrichment_queue.enqueue(str(book_id))
+    book_info["amazon_link"] = f"https://www.amazon.co.jp/dp/{book_id}"
+    book_info["book_id"] = book_id
+    return book_info
 
 
 def get_book_info_from_df(dataframe):
-    result_list = []
-    for row in dataframe.itertuples(index=False):
-        book_id = row.book_id
-        book_info = BookData(str(book_id)).get_data()
-        book_info["amazon_link"] = f"https://www.amazon.co.jp/dp/{row.book_id}"
-        book_info["book_id"] = book_id
-        result_list.append(book_info)
-    return result_list
+    books = db.get_books_bulk(str(book_id) for book_id in dataframe.book_id)
+    return [
+        get_book_info(book_id, books.get(str(book_id))) for book_id in dataframe.book_id
+    ]
 
 
 def error_handler(predicted_title, error: str, year=datetime.now().year):
@@ -45,32 +66,20 @@ def index() -> Union[str, Response]:
                 if not search_word:
                     return render_template("index.html", year=year)
 
-                db = Database()
                 book_id_list = db.search_books_by_title_and_authors(search_word)
                 print(book_id_list)
                 if not book_id_list:
                     return error_handler(search_word, "わーお、博識！", year=year)
 
                 book_list = []
+                books = db.get_books_bulk(book_id_list[:result_num])
                 for book_id in book_id_list[:result_num]:
-                    # book_id = book_id["_id"]
-                    book_info = db.get_book(book_id)
+                    book_info = books.get(book_id)
 
                     if not book_info:
                         raise Exception(f"Search keyword: {search_word} not found")
 
-                    # book_info のkeyが足りない場合は、BookDataから取得
-                    if not book_info.get("authors"):
-                        print(f"Book ID {book_id} not found in database")
-                        book_info = BookData(str(book_id)).get_data()
-
-                    # データが欠けている場合は、Google Books APIから取得
-                    if not book_info.get("authors"):
-                        print(f"Book ID {book_id} not found in Google Books API")
-                        book_info = BookData(str(book_id)).get_data()
-
-                    book_info["amazon_link"] = f"https://www.amazon.co.jp/dp/{book_id}"
-                    book_info["book_id"] = book_id
+                    book_info = get_book_info(book_id, book_info)
                     print(book_info)
                     book_list.append(book_info)
 
@@ -84,7 +93,6 @@ def index() -> Union[str, Response]:
 
             elif action_type == "book_title_click":
                 book_id = request.form["search"]
-                db = Database()
                 title = db.get_book_title(str(book_id))
                 print(title, book_id)
 
@@ -111,5 +119,13 @@ def index() -> Union[str, Response]:
     return render_template("index.html", year=year)
 
 
+@app.route("/suggest", methods=["GET"])
+def suggest() -> Response:
+    query = request.args.get("q", "")
+    if suggest_index is None:
+        return jsonify([])
+    return jsonify(suggest_index.search(query, limit=10))
+
+
 if __name__ == "__main__":
     app.run(debug=True)